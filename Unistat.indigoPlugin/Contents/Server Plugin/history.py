@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Unistat history file.
+#
+# One file per unistat holding a fixed number of fixed-width records in a
+# ring, memory-mapped so an append is a single struct pack into the mapping.
+# Opening a file with a different capacity rewrites it to the new size,
+# keeping the newest records that fit.
+# Records are in time order starting at the oldest, so readers can seek by
+# time with a binary search and scan the mapping directly; with NumPy,
+# numpy.frombuffer(mapping, RECORD_DTYPE, offset=HEADER.size) reads the ring
+# without parsing.  Free of any dependency on the indigo module.
+
+import os
+import mmap
+import struct
+
+MAGIC = b'UNIH'
+VERSION = 1
+DEFAULT_CAPACITY = 65536    # records, 1 MB per unistat
+READ_BLOCK = 4096           # records copied out of the mapping at a time
+
+# magic, version, record size, capacity, records ever written
+HEADER = struct.Struct('<4sIIIQ8x')
+WRITTEN = struct.Struct('<Q')
+WRITTEN_OFFSET = 16
+
+# time (epoch seconds), value, kind
+RECORD = struct.Struct('<dfB3x')
+RECORD_DTYPE = [('time','<f8'), ('value','<f4'), ('kind','u1'), ('pad','V3')]
+
+# record kinds; equipment records have value 1.0 for on and 0.0 for off
+INPUT  = 1
+COOLER = 2
+HEATER = 3
+
+KIND_NAMES = {INPUT:'input', COOLER:'cooler', HEATER:'heater'}
+
+################################################################################
+class HistoryFile(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        size = HEADER.size + capacity*RECORD.size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            kept = self._resized(fd, capacity)
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, recordSize, fileCapacity, written = HEADER.unpack_from(self.map, 0)
+        if kept is not None:
+            # rewritten in time order from the start of the ring
+            written = len(kept)//RECORD.size
+            self.map[HEADER.size:HEADER.size + len(kept)] = kept
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, capacity, written)
+        elif (magic, version, recordSize, fileCapacity) != (MAGIC, VERSION, RECORD.size, capacity):
+            # new file, or one written with a different layout
+            written = 0
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, capacity, written)
+        self.written = written
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def _resized(fd, capacity):
+        # records of a file written with another capacity, oldest first and
+        # limited to the newest that fit, or None if the file is not one of those
+        header = os.pread(fd, HEADER.size, 0)
+        if len(header) != HEADER.size:
+            return None
+        magic, version, recordSize, fileCapacity, written = HEADER.unpack(header)
+        if (magic, version, recordSize) != (MAGIC, VERSION, RECORD.size) or fileCapacity == capacity:
+            return None
+        ring = os.pread(fd, fileCapacity*RECORD.size, HEADER.size)
+        if len(ring) != fileCapacity*RECORD.size:
+            return None
+        held = min(written, fileCapacity)
+        start = (written - held) % fileCapacity * RECORD.size
+        ordered = (ring[start:] + ring[:start])[:held*RECORD.size]
+        return ordered[-capacity*RECORD.size:] if held > capacity else ordered
+
+    #-------------------------------------------------------------------------------
+    def append(self, timestamp, kind, value):
+        RECORD.pack_into(self.map, HEADER.size + (self.written % self.capacity)*RECORD.size, timestamp, value, kind)
+        self.written += 1
+        WRITTEN.pack_into(self.map, WRITTEN_OFFSET, self.written)
+
+    #-------------------------------------------------------------------------------
+    @property
+    def count(self):
+        # records held
+        return min(self.written, self.capacity)
+
+    #-------------------------------------------------------------------------------
+    def _offset(self, position):
+        # position 0 is the oldest record held
+        return HEADER.size + ((self.written - self.count + position) % self.capacity)*RECORD.size
+
+    #-------------------------------------------------------------------------------
+    def _timeAt(self, position):
+        return struct.unpack_from('<d', self.map, self._offset(position))[0]
+
+    #-------------------------------------------------------------------------------
+    def _search(self, start):
+        # first position with time >= start
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high)//2
+            if self._timeAt(middle) < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    #-------------------------------------------------------------------------------
+    def records(self, start=None, end=None, kinds=None):
+        # (time, kind, value) tuples in time order, optionally limited to a range and kinds
+        position = self._search(start) if start is not None else 0
+        count = self.count
+        while position < count:
+            # read in blocks up to the end of the file, then wrap to the start
+            first = self._offset(position)
+            last = min(HEADER.size + self.capacity*RECORD.size, first + min(count - position, READ_BLOCK)*RECORD.size)
+            for timestamp, value, kind in RECORD.iter_unpack(self.map[first:last]):
+                if end is not None and timestamp > end:
+                    return
+                if kinds is None or kind in kinds:
+                    yield timestamp, kind, value
+            position += (last - first)//RECORD.size
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        if not self.map.closed:
+            self.map.flush()
+            self.map.close()
@@ -0,0 +1,20 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Unistat decision logic.
+#
+# Deliberately free of any dependency on the indigo module so the same rules
+# can be driven by offline tools.  Every function works on plain floats and
+# bools as well as on NumPy arrays, which are combined element-wise.
+
+################################################################################
+# Hysteresis
+################################################################################
+def coolerState(isOn, enabled, value, setpoint, halfband):
+    # on above the band, off at or below it, unchanged inside it
+    return enabled & ((value > setpoint + halfband) | (isOn & (value > setpoint - halfband)))
+
+#-------------------------------------------------------------------------------
+def heaterState(isOn, enabled, value, setpoint, halfband):
+    # on below the band, off at or above it, unchanged inside it
+    return enabled & ((value < setpoint - halfband) | (isOn & (value < setpoint + halfband)))
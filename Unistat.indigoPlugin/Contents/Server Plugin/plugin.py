@@ -5,7 +5,52 @@
 # http://www.indigodomo.com
 
 import indigo #noqa
+import os
+import re
+import csv
+import json
+import math
 import time
+import heapq
+import itertools
+from bisect import bisect_left, insort
+import threading
+from array import array
+from collections import deque, OrderedDict
+from datetime import datetime, date, timedelta
+from functools import wraps
+
+from hysteresis import coolerState, heaterState
+from history import HistoryFile, DEFAULT_CAPACITY, INPUT, COOLER, HEATER, KIND_NAMES
+
+# NumPy is only needed for batch evaluation
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# most equipment commands resent by one reconcile pass
+RECONCILE_MAX_RESENDS = 8
+
+# thermostat props every unistat needs
+UNISTAT_PROPS = {
+    'SupportsHvacOperationMode'     : True,
+    'SupportsHvacFanMode'           : False,
+    'ShowCoolHeatEquipmentStateUI'  : True,
+    'NumTemperatureInputs'          : 1,
+    'NumHumidityInputs'             : 0,
+    }
+
+# custom states from Devices.xml; a device missing any of them was created by
+# an older version and needs its state list refreshed
+CUSTOM_STATES = (
+    'hvacCoolerNextChange', 'hvacCoolerChangePending',
+    'hvacHeaterNextChange', 'hvacHeaterChangePending',
+    'hvacCoolerRuntimeToday', 'hvacCoolerCyclesToday',
+    'hvacHeaterRuntimeToday', 'hvacHeaterCyclesToday',
+    'scheduleNextChange', 'scheduleHoldUntil',
+    'inputTrend',
+    )
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -13,6 +58,14 @@ import time
 ################################################################################
 # Globals
 
+def synchronized(method):
+    # serialize host callbacks with timers run from runConcurrentThread
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 ################################################################################
 class Plugin(indigo.PluginBase):
 
@@ -24,46 +77,298 @@ class Plugin(indigo.PluginBase):
     # Start, Stop and Config changes
     #-------------------------------------------------------------------------------
     def startup(self):
+        self.startupTime = time.perf_counter()
         self.debug = self.pluginPrefs.get("showDebugInfo",False)
         self.logger.debug(u"startup")
         if self.debug:
             self.logger.debug(u"Debug logging enabled")
         self.deviceDict = dict()
 
+        # reverse index of input id (and state key) -> subscribing unistats
+        self.deviceSubscribers = dict()
+        self.variableSubscribers = dict()
+        self.eventsDispatched = 0
+        self.eventsDropped = 0
+        self.eventsUnchanged = 0
+
+        # reverse index of controlled device id -> unistats
+        self.equipmentSubscribers = dict()
+
+        # equipment commands and timers are run from runConcurrentThread
+        self.lock = threading.RLock()
+        self.wakeEvent = threading.Event()
+        self.commandQueue = CommandQueue(self.logger, self.wakeEvent)
+        self.scheduler = Scheduler(self.logger, self.wakeEvent)
+
+        # demand for each controlled device, shared by all device unistats
+        self.equipmentRegistry = EquipmentRegistry(self.logger, self.commandQueue)
+
+        # per-unistat history files
+        self.pluginFolder = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins', self.pluginId)
+        self.historyFolder = os.path.join(self.pluginFolder, 'history')
+        try:
+            os.makedirs(self.historyFolder, exist_ok=True)
+        except OSError as e:
+            self.logger.error(f'Unable to create history folder {self.historyFolder}: {e}')
+        self.historyCapacity = int(self.pluginPrefs.get('historyCapacity', DEFAULT_CAPACITY))
+
+        # controller state saved at the last shutdown, and unistats started before
+        # runConcurrentThread, which read their inputs together once it starts
+        self.snapshotPath = os.path.join(self.pluginFolder, 'snapshot.json')
+        self.snapshots = self.loadSnapshots()
+        self.startPending = list()
+        self.started = False
+
+        # periodic check that controlled devices are in the commanded state
+        self.reconcileInterval = float(self.pluginPrefs.get('reconcileInterval', 120))
+        self.reconcileRetries = int(self.pluginPrefs.get('reconcileRetries', 5))
+        self.reconcileTimer = None
+        self.scheduleReconcile()
+
+        # device and action group choices for the config dialogs
+        self.catalog = DeviceCatalog()
+
+        # optional evaluation of every unistat together on a shared tick
+        self.batch = None
+        self.configureBatch(self.pluginPrefs)
+
         indigo.devices.subscribeToChanges()
         indigo.variables.subscribeToChanges()
+        indigo.actionGroups.subscribeToChanges()
 
     #-------------------------------------------------------------------------------
     def shutdown(self):
         self.logger.debug(u"shutdown")
         self.pluginPrefs['showDebugInfo'] = self.debug
+        self.saveSnapshots()
+
+    #-------------------------------------------------------------------------------
+    def loadSnapshots(self):
+        try:
+            with open(self.snapshotPath) as snapshotFile:
+                return {int(devId):snapshot for devId, snapshot in json.load(snapshotFile).items()}
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError) as e:
+            self.logger.error(f'Unable to read controller snapshot: {e}')
+            return dict()
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def saveSnapshots(self):
+        for unistatDevice in self.deviceDict.values():
+            self.snapshots[unistatDevice.id] = unistatDevice.snapshot()
+        try:
+            with open(self.snapshotPath + '.tmp', 'w') as snapshotFile:
+                json.dump(self.snapshots, snapshotFile)
+            os.replace(self.snapshotPath + '.tmp', self.snapshotPath)
+        except OSError as e:
+            self.logger.error(f'Unable to save controller snapshot: {e}')
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def finishStartup(self):
+        # read the inputs of every unistat started so far in one pass over the devices
+        pending = [unistatDevice for unistatDevice in self.startPending if self.deviceDict.get(unistatDevice.id) is unistatDevice]
+        self.startPending = list()
+        self.started = True
+        if pending:
+            deviceIds = {deviceId for unistatDevice in pending for deviceId, stateKey in unistatDevice.inputDeviceStates}
+            devices = {dev.id:dev for dev in indigo.devices.iter() if dev.id in deviceIds} if deviceIds else dict()
+            variableIds = {variableId for unistatDevice in pending for variableId in unistatDevice.inputVariableIds}
+            variables = {var.id:var for var in indigo.variables.iter() if var.id in variableIds} if variableIds else dict()
+            for unistatDevice in pending:
+                unistatDevice.requestTemperature(devices, variables)
+        self.logger.info(f'Started {len(self.deviceDict)} unistats in {(time.perf_counter() - self.startupTime)*1000:.0f} ms')
+
+    #-------------------------------------------------------------------------------
+    def runConcurrentThread(self):
+        self.finishStartup()
+        try:
+            while True:
+                self.wakeEvent.wait(self.scheduler.timeUntilNext())
+                self.wakeEvent.clear()
+                with self.lock:
+                    self.scheduler.runDue()
+                self.commandQueue.drain()
+                if self.stopThread:
+                    break
+        except self.StopThread:
+            pass
+
+    #-------------------------------------------------------------------------------
+    def stopConcurrentThread(self):
+        super(Plugin, self).stopConcurrentThread()
+        self.wakeEvent.set()
+
+    #-------------------------------------------------------------------------------
+    def validatePrefsConfigUi(self, valuesDict):
+        errorsDict = indigo.Dict()
+
+        if not validateTextFieldNumber(valuesDict.get('reconcileInterval','120'), numType=float, zero=True, negative=False):
+            errorsDict['reconcileInterval'] = "Must be a number 0 or greater"
+
+        if not validateTextFieldNumber(valuesDict.get('reconcileRetries','5'), numType=int, zero=False, negative=False):
+            errorsDict['reconcileRetries'] = "Must be a positive integer"
+
+        if not validateTextFieldNumber(valuesDict.get('historyCapacity',str(DEFAULT_CAPACITY)), numType=int, zero=False, negative=False):
+            errorsDict['historyCapacity'] = "Must be a positive integer"
+
+        if valuesDict.get('batchEvaluation', False):
+            if not validateTextFieldNumber(valuesDict.get('batchInterval','1'), numType=float, zero=False, negative=False):
+                errorsDict['batchInterval'] = "Must be a positive number"
+
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
 
     #-------------------------------------------------------------------------------
+    @synchronized
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         self.logger.debug(u"closedPrefsConfigUi")
         if not userCancelled:
             self.debug = valuesDict.get('showDebugInfo',False)
             if self.debug:
                 self.logger.debug(u"Debug logging enabled")
+            self.reconcileInterval = float(valuesDict.get('reconcileInterval', 120))
+            self.reconcileRetries = int(valuesDict.get('reconcileRetries', 5))
+            self.scheduleReconcile()
+            self.configureBatch(valuesDict)
+            historyCapacity = int(valuesDict.get('historyCapacity', DEFAULT_CAPACITY))
+            if historyCapacity != self.historyCapacity:
+                self.historyCapacity = historyCapacity
+                for unistatDevice in self.deviceDict.values():
+                    self.attachHistory(unistatDevice)
+
+    #-------------------------------------------------------------------------------
+    def configureBatch(self, prefs):
+        enabled = prefs.get('batchEvaluation', False)
+        if enabled and np is None:
+            self.logger.warning('Batch evaluation needs NumPy, which is not installed; evaluating each unistat on its own')
+            enabled = False
+
+        if enabled:
+            interval = float(prefs.get('batchInterval', 1))
+            if self.batch:
+                self.batch.interval = interval
+            else:
+                self.batch = BatchEvaluator(self.scheduler, interval)
+                for unistatDevice in self.deviceDict.values():
+                    self.batch.add(unistatDevice)
+                    unistatDevice.evaluate()
+        elif self.batch:
+            # settle anything still waiting for a tick before going back to single evaluation
+            self.batch.tick()
+            for unistatDevice in self.deviceDict.values():
+                self.batch.remove(unistatDevice)
+            self.batch = None
+
+    #-------------------------------------------------------------------------------
+    # Equipment reconciliation
+    #-------------------------------------------------------------------------------
+    def scheduleReconcile(self):
+        if self.reconcileTimer:
+            self.reconcileTimer.cancel()
+            self.reconcileTimer = None
+        if self.reconcileInterval:
+            self.reconcileTimer = self.scheduler.callAt(time.time() + self.reconcileInterval, self.reconcileEquipment)
+
+    #-------------------------------------------------------------------------------
+    def reconcileEquipment(self):
+        # run from runConcurrentThread by the scheduler
+        self.reconcileTimer = None
+        self.scheduleReconcile()
+        registry = self.equipmentRegistry
+        if not registry.entries:
+            return
+
+        # one pass over the device list for every controlled device
+        devices = {dev.id:dev for dev in indigo.devices.iter() if dev.id in registry.entries}
+        resent = registry.reconcile(devices, time.time(), self.reconcileInterval, self.reconcileRetries, RECONCILE_MAX_RESENDS)
+        if resent >= RECONCILE_MAX_RESENDS:
+            self.logger.debug('reconcile resend limit reached, continuing next pass')
 
     #-------------------------------------------------------------------------------
     # Device Methods
     #-------------------------------------------------------------------------------
+    @synchronized
     def deviceStartComm(self, dev):
         self.logger.debug(u"deviceStartComm: {}".format(dev.name))
         if dev.configured:
+            if not all(key in dev.states for key in CUSTOM_STATES):
+                dev.stateListOrDisplayStateIdChanged()
+            previous = self.removeUnistat(dev.id)
             if dev.deviceTypeId == 'DeviceUnistat':
-                self.deviceDict[dev.id] = DeviceUnistat(dev, self.logger)
+                unistatDevice = DeviceUnistat(dev, self.logger, self.commandQueue, self.scheduler, self.equipmentRegistry)
             elif dev.deviceTypeId == 'ActionGroupUnistat':
-                self.deviceDict[dev.id] = ActionGroupUnistat(dev, self.logger)
+                unistatDevice = ActionGroupUnistat(dev, self.logger, self.commandQueue, self.scheduler)
+            else:
+                return
+            if previous:
+                # keep statistics across config changes
+                unistatDevice.stats = previous.stats
+            self.attachHistory(unistatDevice)
+            snapshot = self.snapshots.pop(dev.id, None)
+            if snapshot:
+                unistatDevice.restore(snapshot)
+            self.addUnistat(unistatDevice)
+            if self.started:
+                unistatDevice.requestTemperature()
+            else:
+                self.startPending.append(unistatDevice)
 
     #-------------------------------------------------------------------------------
+    @synchronized
     def deviceStopComm(self, dev):
         self.logger.debug(u"deviceStopComm: {}".format(dev.name))
-        if dev.id in self.deviceDict:
-            del self.deviceDict[dev.id]
+        self.removeUnistat(dev.id)
+
+    #-------------------------------------------------------------------------------
+    def historyPath(self, devId):
+        return os.path.join(self.historyFolder, f'{devId}.bin')
 
     #-------------------------------------------------------------------------------
+    def attachHistory(self, unistatDevice):
+        try:
+            unistatDevice.attachHistory(self.historyPath(unistatDevice.id), self.historyCapacity)
+        except (OSError, ValueError) as e:
+            self.logger.error(f'"{unistatDevice.name}" history file unavailable: {e}')
+
+    #-------------------------------------------------------------------------------
+    def addUnistat(self, unistatDevice):
+        self.deviceDict[unistatDevice.id] = unistatDevice
+        if self.batch:
+            self.batch.add(unistatDevice)
+        for deviceId, stateKey in unistatDevice.inputDeviceStates:
+            stateSubscribers = self.deviceSubscribers.setdefault(deviceId, dict())
+            stateSubscribers.setdefault(stateKey, list()).append(unistatDevice)
+        for variableId in unistatDevice.inputVariableIds:
+            self.variableSubscribers.setdefault(variableId, list()).append(unistatDevice)
+        for deviceId in unistatDevice.equipmentDeviceIds:
+            self.equipmentSubscribers.setdefault(deviceId, list()).append(unistatDevice)
+
+    #-------------------------------------------------------------------------------
+    def removeUnistat(self, devId):
+        unistatDevice = self.deviceDict.pop(devId, None)
+        if unistatDevice:
+            self.snapshots[devId] = unistatDevice.snapshot()
+            if unistatDevice.batch:
+                unistatDevice.batch.remove(unistatDevice)
+            unistatDevice.stop()
+            for deviceId, stateKey in unistatDevice.inputDeviceStates:
+                stateSubscribers = self.deviceSubscribers.get(deviceId)
+                if stateSubscribers:
+                    unsubscribe(stateSubscribers, stateKey, unistatDevice)
+                    if not stateSubscribers:
+                        del self.deviceSubscribers[deviceId]
+            for variableId in unistatDevice.inputVariableIds:
+                unsubscribe(self.variableSubscribers, variableId, unistatDevice)
+            for deviceId in unistatDevice.equipmentDeviceIds:
+                unsubscribe(self.equipmentSubscribers, deviceId, unistatDevice)
+        return unistatDevice
+
+    #-------------------------------------------------------------------------------
+    @synchronized
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
         errorsDict = indigo.Dict()
 
@@ -71,8 +376,7 @@ class Plugin(indigo.PluginBase):
         if valuesDict.get('inputType','dev') == 'dev':
             if valuesDict.get('inputDevice',0):
                 if valuesDict.get('inputState',''):
-                    testStateValue = indigo.devices[int(valuesDict['inputDevice'])].states[valuesDict['inputState']]
-                    if not validateTextFieldNumber(testStateValue, numType=float, zero=True, negative=True):
+                    if valuesDict['inputState'] not in self.catalog.numericStates(zint(valuesDict['inputDevice'])):
                         errorsDict['inputState'] = "Must be a numerical state"
                 else:
                     errorsDict['inputState'] = "Required"
@@ -87,12 +391,66 @@ class Plugin(indigo.PluginBase):
             else:
                 errorsDict['inputVariable'] = "Required"
 
+        elif valuesDict.get('inputType','dev') == 'multi':
+            deviceList = valuesDict.get('aggregateDevices',[])
+            variableList = valuesDict.get('aggregateVariables',[])
+            if deviceList:
+                stateKey = valuesDict.get('aggregateState','')
+                if stateKey:
+                    for deviceId in deviceList:
+                        if stateKey not in self.catalog.numericStates(zint(deviceId)):
+                            errorsDict['aggregateState'] = f'Must be a numerical state of every device ("{indigo.devices[int(deviceId)].name}")'
+                            break
+                else:
+                    errorsDict['aggregateState'] = "Required"
+            for variableId in variableList:
+                testStateValue = indigo.variables[int(variableId)].value
+                if not validateTextFieldNumber(testStateValue, numType=float, zero=True, negative=True):
+                    errorsDict['aggregateVariables'] = f'Must all have numerical values ("{indigo.variables[int(variableId)].name}")'
+                    break
+            if not (deviceList or variableList):
+                errorsDict['aggregateDevices'] = "Select at least one device or variable"
+
         if not validateTextFieldNumber(valuesDict['deadband'], numType=float, zero=True, negative=False):
             errorsDict['deadband'] = "Must be a number 0 or greater"
 
         if not validateTextFieldNumber(valuesDict['inputDecimals'], numType=int, zero=True, negative=False):
             errorsDict['inputDecimals'] = "Must be an integer 0 or greater"
 
+        if not validateTextFieldNumber(valuesDict.get('inputMinInterval','0'), numType=float, zero=True, negative=False):
+            errorsDict['inputMinInterval'] = "Must be a number 0 or greater"
+
+        if not validateTextFieldNumber(valuesDict.get('inputChangeSteps','0'), numType=int, zero=True, negative=False):
+            errorsDict['inputChangeSteps'] = "Must be an integer 0 or greater"
+
+        # validate equipment protection
+        for key in ['minRunTime','minOffTime']:
+            if not validateTextFieldNumber(valuesDict.get(key,'0'), numType=float, zero=True, negative=False):
+                errorsDict[key] = "Must be a number 0 or greater"
+
+        if not validateTextFieldNumber(valuesDict.get('maxCyclesPerHour','0'), numType=int, zero=True, negative=False):
+            errorsDict['maxCyclesPerHour'] = "Must be an integer 0 or greater"
+
+        # validate schedule
+        if valuesDict.get('scheduleEnabled', False):
+            try:
+                WeeklySchedule(valuesDict.get('schedule',''))
+            except ValueError as e:
+                errorsDict['schedule'] = str(e)
+            if valuesDict.get('scheduleHold','next') == 'hours':
+                if not validateTextFieldNumber(valuesDict.get('holdDuration','2'), numType=float, zero=False, negative=False):
+                    errorsDict['holdDuration'] = "Must be a positive number"
+
+        # validate control strategy
+        if valuesDict.get('controlStrategy','hysteresis') == 'predictive':
+            if not validateTextFieldNumber(valuesDict.get('predictiveHorizon','10'), numType=float, zero=True, negative=False):
+                errorsDict['predictiveHorizon'] = "Must be a number 0 or greater"
+            try:
+                if int(valuesDict.get('predictiveSamples','12')) < 2:
+                    raise ValueError
+            except ValueError:
+                errorsDict['predictiveSamples'] = "Must be an integer 2 or greater"
+
         # validate device unistat
         if typeId == 'DeviceUnistat':
             if not validateTextFieldNumber(valuesDict['dimmerControlLevel'], numType=int, zero=False, negative=False):
@@ -107,17 +465,20 @@ class Plugin(indigo.PluginBase):
     #-------------------------------------------------------------------------------
     # Device Config callbacks
     #-------------------------------------------------------------------------------
+    @synchronized
     def getInputDeviceList(self, filter='', valuesDict=dict(), typeId='', targetId=0):
-        return [(dev.id, dev.name) for dev in indigo.devices.iter() if (dev.id != targetId)]
+        return [item for item in self.catalog.inputDevices() if item[0] != targetId]
 
     #-------------------------------------------------------------------------------
+    @synchronized
     def getDeviceStateList(self, filter=None, valuesDict=dict(), typeId='', targetId=0):
         devId = zint(valuesDict.get(filter,0))
-        return [(state, state) for state in indigo.devices[devId].states] if devId else []
+        return [(state, state) for state in self.catalog.numericStates(devId)] if devId else []
 
     #-------------------------------------------------------------------------------
+    @synchronized
     def getActionGroups(self, filter=None, valuesDict=dict(), typeId='', targetId=0):
-        return [(action.id, action.name) for action in indigo.actionGroups.iter()] + [(0,'-- None --')]
+        return self.catalog.actionGroupChoices()
 
     #-------------------------------------------------------------------------------
     def loadStates(self, valuesDict=None, typeId='', targetId=0):
@@ -126,6 +487,7 @@ class Plugin(indigo.PluginBase):
     #-------------------------------------------------------------------------------
     # Thermostat Action callback
     #-------------------------------------------------------------------------------
+    @synchronized
     def actionControlThermostat(self, action, dev):
         unistatDevice = self.deviceDict[dev.id]
 
@@ -163,9 +525,80 @@ class Plugin(indigo.PluginBase):
         else:
             self.logger.debug(f'"{dev.name}" {action.thermostatAction} action not available')
 
+        # manual setpoint changes hold off the schedule for a while
+        if action.thermostatAction in (
+                indigo.kThermostatAction.SetCoolSetpoint, indigo.kThermostatAction.SetHeatSetpoint,
+                indigo.kThermostatAction.DecreaseCoolSetpoint, indigo.kThermostatAction.IncreaseCoolSetpoint,
+                indigo.kThermostatAction.DecreaseHeatSetpoint, indigo.kThermostatAction.IncreaseHeatSetpoint):
+            unistatDevice.startHold()
+
+        unistatDevice.evaluate()
+
+    #-------------------------------------------------------------------------------
+    # Custom Action callbacks
+    #-------------------------------------------------------------------------------
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        errorsDict = indigo.Dict()
+
+        if typeId == 'exportHistory':
+            for key in ['startTime','endTime']:
+                try:
+                    parseTimeField(valuesDict.get(key,''))
+                except ValueError:
+                    errorsDict[key] = "Must be blank or a date and time like 2024-01-31 18:00"
+            if not valuesDict.get('exportPath','').strip():
+                errorsDict['exportPath'] = "Required"
+
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def exportHistory(self, action, dev):
+        unistatDevice = self.deviceDict.get(dev.id)
+        if not (unistatDevice and unistatDevice.history):
+            self.logger.error(f'"{dev.name}" has no history to export')
+            return
+        try:
+            start = parseTimeField(action.props.get('startTime',''))
+            end = parseTimeField(action.props.get('endTime',''))
+        except ValueError:
+            self.logger.error(f'"{dev.name}" export time range is not valid')
+            return
+
+        path = os.path.expanduser(action.props.get('exportPath','').strip())
+        count = 0
+        try:
+            with open(path, 'w', newline='') as csvFile:
+                writer = csv.writer(csvFile)
+                writer.writerow(['time', 'timestamp', 'kind', 'value'])
+                for timestamp, kind, value in unistatDevice.history.records(start, end):
+                    if kind == INPUT:
+                        value = f'{value:.{unistatDevice.decimals}f}'
+                    else:
+                        value = ['off','on'][value > 0.0]
+                    writer.writerow([formatTime(timestamp), f'{timestamp:.3f}', KIND_NAMES.get(kind, kind), value])
+                    count += 1
+        except OSError as e:
+            self.logger.error(f'"{dev.name}" history export to {path} failed: {e}')
+            return
+        self.logger.info(f'"{dev.name}" exported {count} history records to {path}')
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def resumeSchedule(self, action, dev):
+        unistatDevice = self.deviceDict[dev.id]
+        if not unistatDevice.schedule:
+            self.logger.error(f'"{dev.name}" has no schedule')
+            return
+        unistatDevice.endHold()
+        unistatDevice.evaluate()
+
     #-------------------------------------------------------------------------------
     # General Action callback
     #-------------------------------------------------------------------------------
+    @synchronized
     def actionControlUniversal(self, action, dev):
         unistatDevice = self.deviceDict[dev.id]
 
@@ -189,52 +622,1216 @@ class Plugin(indigo.PluginBase):
             self.debug = True
             self.logger.debug(u"Debug logging enabled")
 
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def logDispatchStatistics(self):
+        total = self.eventsDispatched + self.eventsDropped + self.eventsUnchanged
+        self.logger.info(f'Dispatch statistics: {total} input events, {self.eventsDispatched} dispatched, {self.eventsDropped} dropped, {self.eventsUnchanged} unchanged')
+        self.logger.info(f'  {len(self.deviceSubscribers)} input devices and {len(self.variableSubscribers)} input variables watched by {len(self.deviceDict)} unistats')
+        queue = self.commandQueue
+        meanLatency = queue.latencyTotal/queue.sent if queue.sent else 0.0
+        self.logger.info(f'Command queue: {queue.sent} sent, {queue.coalesced} coalesced, {queue.errors} errors, {len(queue.pending)} pending')
+        self.logger.info(f'  enqueue-to-send latency mean {meanLatency*1000:.1f} ms, max {queue.latencyMax*1000:.1f} ms')
+        registry = self.equipmentRegistry
+        shared = sum(1 for entry in registry.entries.values() if len(entry.controls) > 1)
+        self.logger.info(f'Equipment: {len(registry.entries)} devices ({shared} shared), {registry.edges} demand edges commanded, {registry.suppressed} redundant commands suppressed')
+        if self.batch:
+            batch = self.batch
+            self.logger.info(f'Batch evaluation: {batch.ticks} ticks every {batch.interval:g} s, {batch.rowsApplied} unistats updated, {batch.flips} equipment flips')
+        samplesRaw = sum(unistatDevice.inputFilter.samplesRaw for unistatDevice in self.deviceDict.values())
+        samplesAccepted = sum(unistatDevice.inputFilter.samplesAccepted for unistatDevice in self.deviceDict.values())
+        self.logger.info(f'Input samples: {samplesRaw} raw, {samplesAccepted} accepted')
+        for unistatDevice in self.deviceDict.values():
+            inputFilter = unistatDevice.inputFilter
+            if inputFilter.samplesRaw != inputFilter.samplesAccepted:
+                self.logger.info(f'  "{unistatDevice.name}": {inputFilter.samplesRaw} raw, {inputFilter.samplesAccepted} accepted')
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def logControlLoopStatistics(self):
+        self.logger.info(f'Control loop statistics for {len(self.deviceDict)} unistats')
+        for unistatDevice in sorted(self.deviceDict.values(), key=lambda unistatDevice: unistatDevice.name.lower()):
+            stats = unistatDevice.stats
+            elapsed = time.time() - stats.since
+            counters = ', '.join(f'{stats.counters[name]} {label}' for name, label in Statistics.counterLabels)
+            self.logger.info(f'"{unistatDevice.name}" over {elapsed/3600.0:.1f} hours: {counters}')
+            for name, label in Statistics.timingLabels:
+                histogram = stats.timings[name]
+                if histogram.count:
+                    self.logger.info(f'  {label}: {histogram.summary()}')
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def resetControlLoopStatistics(self):
+        for unistatDevice in self.deviceDict.values():
+            unistatDevice.stats = Statistics()
+        self.logger.info(u"Control loop statistics reset")
+
     #-------------------------------------------------------------------------------
     # subscribed changes
     #-------------------------------------------------------------------------------
+    @synchronized
+    def deviceCreated(self, dev):
+        indigo.PluginBase.deviceCreated(self, dev)
+        self.catalog.deviceChanged(dev)
+
+    #-------------------------------------------------------------------------------
+    @synchronized
     def deviceUpdated(self, oldDev, newDev):
+        self.catalog.deviceChanged(newDev)
         if newDev.pluginId == self.pluginId:
             # device belongs to plugin
             indigo.PluginBase.deviceUpdated(self, oldDev, newDev)
             if newDev.id in self.deviceDict:
                 self.deviceDict[newDev.id].selfDeviceUpdated(newDev)
         else:
-            for devId, unistatDevice in self.deviceDict.items():
-                unistatDevice.inputDeviceUpdated(newDev)
+            if newDev.id in self.equipmentSubscribers and type(newDev) is not type(oldDev):
+                # controlled device changed type, so control plans are stale
+                for unistatDevice in self.equipmentSubscribers[newDev.id]:
+                    unistatDevice.buildControlPlans()
+
+            stateSubscribers = self.deviceSubscribers.get(newDev.id)
+            if stateSubscribers:
+                # only dispatch when a subscribed state actually changed
+                dispatched = False
+                for stateKey, subscribers in stateSubscribers.items():
+                    if oldDev.states.get(stateKey) != newDev.states.get(stateKey):
+                        dispatched = True
+                        for unistatDevice in subscribers:
+                            unistatDevice.inputDeviceUpdated(newDev, stateKey)
+                if dispatched:
+                    self.eventsDispatched += 1
+                else:
+                    self.eventsUnchanged += 1
+            else:
+                self.eventsDropped += 1
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def deviceDeleted(self, dev):
+        indigo.PluginBase.deviceDeleted(self, dev)
+        self.catalog.deviceRemoved(dev.id)
+        if dev.pluginId == self.pluginId:
+            # after deviceStopComm, which saves a snapshot on the way out
+            self.removeUnistat(dev.id)
+            self.snapshots.pop(dev.id, None)
+            try:
+                os.remove(self.historyPath(dev.id))
+            except OSError:
+                pass
+        for unistatDevice in self.equipmentSubscribers.pop(dev.id, []):
+            unistatDevice.buildControlPlans()
 
     #-------------------------------------------------------------------------------
+    @synchronized
     def variableUpdated(self, oldVar, newVar):
-        for devId, unistatDevice in self.deviceDict.items():
-            unistatDevice.inputVariableUpdated(newVar)
+        subscribers = self.variableSubscribers.get(newVar.id)
+        if subscribers:
+            if oldVar.value != newVar.value:
+                self.eventsDispatched += 1
+                for unistatDevice in subscribers:
+                    unistatDevice.inputVariableUpdated(newVar)
+            else:
+                self.eventsUnchanged += 1
+        else:
+            self.eventsDropped += 1
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def actionGroupCreated(self, group):
+        self.catalog.actionGroupChanged(group)
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def actionGroupUpdated(self, oldGroup, newGroup):
+        self.catalog.actionGroupChanged(newGroup)
+
+    #-------------------------------------------------------------------------------
+    @synchronized
+    def actionGroupDeleted(self, group):
+        self.catalog.actionGroupRemoved(group.id)
 
 ###############################################################################
 # Classes
+###############################################################################
+class CommandItem(object):
+
+    __slots__ = ('key', 'command', 'args', 'enqueued', 'latency', 'stats')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, key, command, args, enqueued, stats=None):
+        self.key      = key
+        self.command  = command
+        self.args     = args
+        self.enqueued = enqueued
+        self.latency  = None
+        self.stats    = stats
+
+###############################################################################
+class CommandQueue(object):
+    # equipment commands keyed by target; a newer command for the same target
+    # replaces the pending one so only the final state is sent
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, logger, wakeEvent):
+        self.logger = logger
+        self.wakeEvent = wakeEvent
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+
+    #-------------------------------------------------------------------------------
+    def enqueue(self, key, command, *args, stats=None):
+        with self.lock:
+            item = self.pending.pop(key, None)
+            if item:
+                self.coalesced += 1
+                enqueued = item.enqueued
+            else:
+                enqueued = time.time()
+            self.pending[key] = CommandItem(key, command, args, enqueued, stats)
+        self.wakeEvent.set()
+
+    #-------------------------------------------------------------------------------
+    def isPending(self, key):
+        with self.lock:
+            return key in self.pending
+
+    #-------------------------------------------------------------------------------
+    def drain(self):
+        with self.lock:
+            items = list(self.pending.values())
+            self.pending.clear()
+
+        for item in items:
+            try:
+                item.command(*item.args)
+            except Exception as e:
+                self.errors += 1
+                self.logger.error(f'Equipment command {item.key} failed: {e}')
+                if item.stats:
+                    item.stats.count('errors')
+            item.latency = time.time() - item.enqueued
+            self.sent += 1
+            self.latencyTotal += item.latency
+            self.latencyMax = max(self.latencyMax, item.latency)
+            if item.stats:
+                item.stats.timing('commandLatency', item.latency)
+        return items
+
+###############################################################################
+class EquipmentRegistry(object):
+    # reference counts demand for each controlled device across unistats, so
+    # shared equipment is switched on by the first caller, off by the last,
+    # and left alone in between
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, logger, commandQueue):
+        self.logger = logger
+        self.commandQueue = commandQueue
+        self.entries = dict()
+
+        self.edges = 0
+        self.suppressed = 0
+
+    #-------------------------------------------------------------------------------
+    def register(self, unistat, side, plan, onState):
+        # add controls without commanding; the device is assumed to be as the unistat left it
+        owner = (unistat.id, side)
+        for deviceId, command, onValue, offValue in plan:
+            entry = self.entries.get(deviceId)
+            if entry is None:
+                entry = self.entries[deviceId] = EquipmentDemand(deviceId)
+            entry.controls[owner] = (unistat, command, onValue, offValue)
+            if onState:
+                wasDemanded = bool(entry.demand)
+                entry.demand.add(owner)
+                entry.value = onValue
+                if not wasDemanded and self.commandQueue.isPending(('device', deviceId)):
+                    # restarted while the off command from unregister is still queued
+                    entry.retry = None
+                    self.commandQueue.enqueue(('device', deviceId), command, deviceId, onValue, stats=unistat.stats)
+            elif not entry.demand:
+                entry.value = offValue
+
+    #-------------------------------------------------------------------------------
+    def unregister(self, unistat, side, plan):
+        # a shared device loses its last caller like a 1->0 edge; a device no one
+        # controls any more is left as it is
+        owner = (unistat.id, side)
+        for deviceId, command, onValue, offValue in plan:
+            entry = self.entries.get(deviceId)
+            if entry:
+                entry.controls.pop(owner, None)
+                if not entry.controls:
+                    del self.entries[deviceId]
+                elif owner in entry.demand:
+                    entry.demand.discard(owner)
+                    if not entry.demand:
+                        # switched off as the remaining controllers would
+                        other, command, onValue, offValue = next(iter(entry.controls.values()))
+                        self.edges += 1
+                        entry.value = offValue
+                        entry.retry = None
+                        self.commandQueue.enqueue(('device', deviceId), command, deviceId, offValue, stats=other.stats)
+                        other.stats.count('equipmentCommands')
+
+    #-------------------------------------------------------------------------------
+    def setDemand(self, unistat, side, plan, onState):
+        owner = (unistat.id, side)
+        for deviceId, command, onValue, offValue in plan:
+            entry = self.entries.get(deviceId)
+            if entry is None:
+                continue
+            wasDemanded = bool(entry.demand)
+            if onState:
+                entry.demand.add(owner)
+            else:
+                entry.demand.discard(owner)
+            if bool(entry.demand) == wasDemanded:
+                self.suppressed += 1
+                continue
+
+            self.edges += 1
+            entry.value = onValue if onState else offValue
+            entry.retry = None
+            self.commandQueue.enqueue(('device', deviceId), command, deviceId, entry.value, stats=unistat.stats)
+            unistat.stats.count('equipmentCommands')
+
+    #-------------------------------------------------------------------------------
+    def reconcile(self, devices, now, interval, maxRetries, budget):
+        # resend to devices not at the demanded value; returns commands resent
+        resent = 0
+        for entry in self.entries.values():
+            device = devices.get(entry.deviceId)
+            if device is None or self.commandQueue.isPending(('device', entry.deviceId)):
+                continue
+            # expect what the current demand calls for, not whatever was commanded last
+            owner = entry.owner()
+            unistat, command, onValue, offValue = entry.controls[owner]
+            entry.value = onValue if entry.demand else offValue
+            if equipmentValue(device) == entry.value:
+                entry.retry = None
+                if entry.faulted:
+                    entry.faulted = False
+                    self.logger.info(f'Device "{device.name}" is responding again')
+                    for unistat, command, onValue, offValue in entry.controls.values():
+                        unistat.equipmentConfirmed(entry.deviceId)
+                continue
+
+            if entry.retry is None:
+                # give the device a pass to report before resending
+                entry.retry = EquipmentRetry(now + interval/2.0)
+                continue
+            if now < entry.retry.nextAttempt:
+                continue
+            if entry.retry.failures >= maxRetries:
+                if not entry.faulted:
+                    entry.faulted = True
+                    self.logger.error(f'Device "{device.name}" did not reach the commanded state after {entry.retry.failures + 1} attempts')
+                    for unistat, command, onValue, offValue in entry.controls.values():
+                        unistat.equipmentFailed(entry.deviceId)
+                continue
+            if resent >= budget:
+                break
+
+            self.logger.debug('device "%s" is %s, resending %s', device.name, equipmentValue(device), entry.value)
+            entry.retry.backoff(now, interval)
+            self.commandQueue.enqueue(('device', entry.deviceId), command, entry.deviceId, entry.value, stats=unistat.stats)
+            unistat.stats.count('equipmentResends')
+            resent += 1
+        return resent
+
+###############################################################################
+class EquipmentDemand(object):
+    # the unistats controlling one device and which of them are calling for it
+
+    __slots__ = ('deviceId', 'controls', 'demand', 'value', 'retry', 'faulted')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, deviceId):
+        self.deviceId = deviceId
+        self.controls = dict()  # (unistat id, side) -> (unistat, command, on value, off value)
+        self.demand = set()
+        self.value = None       # last value commanded or expected
+        self.retry = None
+        self.faulted = False
+
+    #-------------------------------------------------------------------------------
+    def owner(self):
+        # a controller calling for the device, or any controller if none is
+        return next(iter(self.demand), None) or next(iter(self.controls))
+
+###############################################################################
+class EquipmentRetry(object):
+    # resend bookkeeping for one controlled device that missed a command
+
+    __slots__ = ('failures', 'nextAttempt')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, nextAttempt):
+        self.failures = 0
+        self.nextAttempt = nextAttempt
+
+    #-------------------------------------------------------------------------------
+    def backoff(self, now, interval):
+        # passes between resends double each time: 1, 2, 4, ...
+        self.failures += 1
+        self.nextAttempt = now + interval*(2**(self.failures-1) - 0.5)
+
+###############################################################################
+class DeviceCatalog(object):
+    # devices with numeric states and action groups offered by the config dialogs;
+    # built on first use, then kept current from the change callbacks, which only
+    # note the changed device so the states are examined when a dialog next asks
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.devices = None         # device id -> (name, numeric state keys)
+        self.deviceList = None      # (id, name) sorted by name
+        self.changed = dict()       # device id -> latest device object
+        self.actionGroups = None    # action group id -> name
+        self.actionGroupList = None
+
+    #-------------------------------------------------------------------------------
+    def deviceChanged(self, dev):
+        if self.devices is not None:
+            self.changed[dev.id] = dev
+
+    #-------------------------------------------------------------------------------
+    def deviceRemoved(self, devId):
+        if self.devices is not None:
+            self.changed.pop(devId, None)
+            if self.devices.pop(devId, None):
+                self.deviceList = None
+
+    #-------------------------------------------------------------------------------
+    def actionGroupChanged(self, group):
+        if self.actionGroups is not None and self.actionGroups.get(group.id) != group.name:
+            self.actionGroups[group.id] = group.name
+            self.actionGroupList = None
+
+    #-------------------------------------------------------------------------------
+    def actionGroupRemoved(self, groupId):
+        if self.actionGroups is not None and self.actionGroups.pop(groupId, None) is not None:
+            self.actionGroupList = None
+
+    #-------------------------------------------------------------------------------
+    def _refresh(self):
+        if self.devices is None:
+            self.devices = dict()
+            self.changed.clear()
+            for dev in indigo.devices.iter():
+                self._update(dev)
+        elif self.changed:
+            for dev in self.changed.values():
+                self._update(dev)
+            self.changed.clear()
+
+    #-------------------------------------------------------------------------------
+    def _update(self, dev):
+        numericStates = tuple(key for key, value in dev.states.items() if validateTextFieldNumber(value, numType=float, zero=True, negative=True))
+        entry = (dev.name, numericStates) if numericStates else None
+        previous = self.devices.get(dev.id)
+        if entry != previous:
+            if entry:
+                self.devices[dev.id] = entry
+            else:
+                del self.devices[dev.id]
+            if not (entry and previous and entry[0] == previous[0]):
+                self.deviceList = None
+
+    #-------------------------------------------------------------------------------
+    def inputDevices(self):
+        self._refresh()
+        if self.deviceList is None:
+            self.deviceList = sorted(((devId, entry[0]) for devId, entry in self.devices.items()), key=lambda item: item[1].lower())
+        return self.deviceList
+
+    #-------------------------------------------------------------------------------
+    def numericStates(self, devId):
+        self._refresh()
+        entry = self.devices.get(devId)
+        return entry[1] if entry else ()
+
+    #-------------------------------------------------------------------------------
+    def actionGroupChoices(self):
+        if self.actionGroups is None:
+            self.actionGroups = {group.id:group.name for group in indigo.actionGroups.iter()}
+        if self.actionGroupList is None:
+            self.actionGroupList = sorted(self.actionGroups.items(), key=lambda item: item[1].lower()) + [(0,'-- None --')]
+        return self.actionGroupList
+
+###############################################################################
+class Statistics(object):
+    # per-unistat control loop counters and timing histograms
+
+    counterLabels = (
+        ('inputEvents',       'input events'),
+        ('evaluations',       'evaluations'),
+        ('stateWrites',       'state writes'),
+        ('equipmentCommands', 'equipment commands'),
+        ('equipmentResends',  'equipment resends'),
+        ('errors',            'errors'),
+        )
+
+    timingLabels = (
+        ('evaluation',     'evaluation time'),
+        ('stateWrite',     'state write time'),
+        ('commandLatency', 'command latency'),
+        )
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.since = time.time()
+        self.counters = {name:0 for name, label in self.counterLabels}
+        self.timings = {name:Histogram() for name, label in self.timingLabels}
+
+    #-------------------------------------------------------------------------------
+    def count(self, name, increment=1):
+        self.counters[name] += increment
+
+    #-------------------------------------------------------------------------------
+    def timing(self, name, seconds):
+        self.timings[name].add(seconds)
+
+###############################################################################
+class Histogram(object):
+    # power of two microsecond buckets
+
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.buckets = [0]*40
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    #-------------------------------------------------------------------------------
+    def add(self, seconds):
+        self.buckets[min(int(seconds*1e6).bit_length(), 39)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    #-------------------------------------------------------------------------------
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the requested fraction
+        target = fraction*self.count
+        running = 0
+        for index, bucketCount in enumerate(self.buckets):
+            running += bucketCount
+            if running >= target:
+                return min((2**index)/1e6, self.maximum)
+        return self.maximum
+
+    #-------------------------------------------------------------------------------
+    def summary(self):
+        return (f'n={self.count} mean {self.total/self.count*1000:.2f} ms, '
+                f'p50 <{self.percentile(0.5)*1000:.2f} ms, p99 <{self.percentile(0.99)*1000:.2f} ms, '
+                f'max {self.maximum*1000:.2f} ms')
+
+###############################################################################
+class BatchEvaluator(object):
+    # controller parameters of every unistat as NumPy columns, one row per unistat;
+    # unistats mark their row when their inputs or settings change, and the
+    # hysteresis rule is run over all rows at once on the next tick.  Only rows
+    # that were marked or whose equipment state flips are handed back to their
+    # unistat, which applies equipment protection and writes its states.
+
+    columns = (
+        ('controlValue', 'f8'),
+        ('setpointCool', 'f8'),
+        ('setpointHeat', 'f8'),
+        ('halfband',     'f8'),
+        ('coolEnabled',  '?'),
+        ('heatEnabled',  '?'),
+        ('coolOn',       '?'),
+        ('heatOn',       '?'),
+        ('marked',       '?'),
+        )
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, scheduler, interval, capacity=64):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.unistats = list()
+        self.timer = None
+        for name, dtype in self.columns:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.ticks = 0
+        self.rowsApplied = 0
+        self.flips = 0
+
+    #-------------------------------------------------------------------------------
+    def add(self, unistat):
+        row = len(self.unistats)
+        if row == self.marked.size:
+            for name, dtype in self.columns:
+                column = getattr(self, name)
+                grown = np.zeros(2*column.size, dtype=dtype)
+                grown[:row] = column
+                setattr(self, name, grown)
+        self.unistats.append(unistat)
+        unistat.batch = self
+        unistat.batchRow = row
+        self.marked[row] = False
+
+    #-------------------------------------------------------------------------------
+    def remove(self, unistat):
+        # move the last row into the gap
+        row, last = unistat.batchRow, len(self.unistats) - 1
+        if row != last:
+            for name, dtype in self.columns:
+                column = getattr(self, name)
+                column[row] = column[last]
+            moved = self.unistats[last]
+            self.unistats[row] = moved
+            moved.batchRow = row
+        self.unistats.pop()
+        unistat.batch = None
+        unistat.batchRow = None
+
+    #-------------------------------------------------------------------------------
+    def mark(self, unistat, controlValue):
+        row, state = unistat.batchRow, unistat.state
+        self.controlValue[row] = controlValue
+        self.setpointCool[row] = state.setpointCool
+        self.setpointHeat[row] = state.setpointHeat
+        self.halfband[row] = unistat.halfband
+        self.coolEnabled[row] = state.hvacCoolerEnabled
+        self.heatEnabled[row] = state.hvacHeaterEnabled
+        self.coolOn[row] = state.hvacCoolerIsOn
+        self.heatOn[row] = state.hvacHeaterIsOn
+        self.marked[row] = True
+        if not self.timer:
+            self.timer = self.scheduler.callAt(time.time() + self.interval, self.tick)
+
+    #-------------------------------------------------------------------------------
+    def tick(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        count = len(self.unistats)
+        if not count:
+            return
+        self.ticks += 1
+
+        coolOn, heatOn = self.coolOn[:count], self.heatOn[:count]
+        coolerIsOn = coolerState(coolOn, self.coolEnabled[:count], self.controlValue[:count], self.setpointCool[:count], self.halfband[:count])
+        heaterIsOn = heaterState(heatOn, self.heatEnabled[:count], self.controlValue[:count], self.setpointHeat[:count], self.halfband[:count])
+        flipped = (coolerIsOn != coolOn) | (heaterIsOn != heatOn)
+        rows = np.flatnonzero(flipped | self.marked[:count])
+        self.marked[rows] = False
+        self.flips += int(np.count_nonzero(flipped))
+        self.rowsApplied += rows.size
+
+        unistats = self.unistats
+        for row, cooler, heater in zip(rows.tolist(), coolerIsOn[rows].tolist(), heaterIsOn[rows].tolist()):
+            unistat = unistats[row]
+            unistat.applyEvaluation(cooler, heater, time.perf_counter())
+            # equipment protection may have held the previous state
+            coolOn[row] = unistat.state.hvacCoolerIsOn
+            heatOn[row] = unistat.state.hvacHeaterIsOn
+
+###############################################################################
+class Scheduler(object):
+    # heap of timed callbacks, run from runConcurrentThread at their deadlines
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, logger, wakeEvent):
+        self.logger = logger
+        self.wakeEvent = wakeEvent
+        self.lock = threading.Lock()
+        self.heap = list()
+        self.sequence = itertools.count()
+
+    #-------------------------------------------------------------------------------
+    def callAt(self, when, callback, *args):
+        timer = Timer(when, callback, args)
+        with self.lock:
+            heapq.heappush(self.heap, (when, next(self.sequence), timer))
+        self.wakeEvent.set()
+        return timer
+
+    #-------------------------------------------------------------------------------
+    def timeUntilNext(self):
+        with self.lock:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            if self.heap:
+                return max(self.heap[0][0] - time.time(), 0.0)
+        return None
+
+    #-------------------------------------------------------------------------------
+    def runDue(self):
+        now = time.time()
+        due = list()
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[2])
+        for timer in due:
+            if not timer.cancelled:
+                timer.cancelled = True
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    self.logger.error(f'Timer callback {timer.callback.__name__} failed: {e}')
+        return len(due)
+
+###############################################################################
+class Timer(object):
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, when, callback, args):
+        self.when      = when
+        self.callback  = callback
+        self.args      = args
+        self.cancelled = False
+
+    #-------------------------------------------------------------------------------
+    def cancel(self):
+        self.cancelled = True
+
+###############################################################################
+class InputFilter(object):
+    # rate limit and threshold for raw input samples
+
+    __slots__ = (
+        'minInterval',
+        'threshold',
+        'lastValue',
+        'lastTime',
+        'pendingValue',
+        'samplesRaw',
+        'samplesAccepted',
+        )
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, minInterval=0.0, threshold=0.0):
+        self.minInterval     = minInterval
+        self.threshold       = threshold
+        self.lastValue       = None
+        self.lastTime        = 0.0
+        self.pendingValue    = None
+        self.samplesRaw      = 0
+        self.samplesAccepted = 0
+
+    #-------------------------------------------------------------------------------
+    def offer(self, value, now):
+        self.samplesRaw += 1
+        if self.lastValue is not None:
+            if value == self.lastValue or abs(value - self.lastValue) < self.threshold - 1e-9:
+                # not a meaningful change, and supersedes anything held back
+                self.pendingValue = None
+                return False
+            if now - self.lastTime < self.minInterval:
+                # held back, and applied when the interval expires
+                self.pendingValue = value
+                return False
+        self.accept(value, now)
+        return True
+
+    #-------------------------------------------------------------------------------
+    def accept(self, value, now):
+        self.samplesAccepted += 1
+        self.reset(value, now)
+
+    #-------------------------------------------------------------------------------
+    def reset(self, value, now):
+        self.lastValue = value
+        self.lastTime = now
+        self.pendingValue = None
+
+    #-------------------------------------------------------------------------------
+    @property
+    def nextTime(self):
+        return self.lastTime + self.minInterval
+
+###############################################################################
+class InputAggregator(object):
+    # running mean, min, max or median of several input sources
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, function='mean'):
+        self.function = function
+        self.values = dict()
+        self.ordered = list()
+        self.total = 0.0
+
+    #-------------------------------------------------------------------------------
+    def update(self, source, value):
+        # a value that is not finite would stay in the running total and break the ordering
+        if not math.isfinite(value):
+            raise ValueError(f'not a finite number: {value}')
+        self.remove(source)
+        self.values[source] = value
+        self.total += value
+        if self.function != 'mean':
+            insort(self.ordered, value)
+
+    #-------------------------------------------------------------------------------
+    def remove(self, source):
+        value = self.values.pop(source, None)
+        if value is not None:
+            self.total -= value
+            if self.function != 'mean':
+                del self.ordered[bisect_left(self.ordered, value)]
+
+    #-------------------------------------------------------------------------------
+    @property
+    def value(self):
+        count = len(self.values)
+        if not count:
+            return None
+        elif self.function == 'min':
+            return self.ordered[0]
+        elif self.function == 'max':
+            return self.ordered[-1]
+        elif self.function == 'median':
+            middle = count//2
+            if count % 2:
+                return self.ordered[middle]
+            return (self.ordered[middle-1] + self.ordered[middle])/2.0
+        else:
+            return self.total/count
+
+###############################################################################
+class CycleGuard(object):
+    # minimum on/off times and cycle rate limit for one side of the equipment
+
+    __slots__ = (
+        'minOnTime',
+        'minOffTime',
+        'maxCycles',
+        'lastChange',
+        'starts',
+        )
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, minOnTime=0.0, minOffTime=0.0, maxCycles=0):
+        self.minOnTime  = minOnTime
+        self.minOffTime = minOffTime
+        self.maxCycles  = maxCycles
+        self.lastChange = 0.0
+        self.starts     = deque()
+
+    #-------------------------------------------------------------------------------
+    def allowedAt(self, onState, now):
+        if onState:
+            when = self.lastChange + self.minOffTime
+            if self.maxCycles:
+                while self.starts and self.starts[0] <= now - 3600.0:
+                    self.starts.popleft()
+                if len(self.starts) >= self.maxCycles:
+                    when = max(when, self.starts[0] + 3600.0)
+        else:
+            when = self.lastChange + self.minOnTime
+        return when
+
+    #-------------------------------------------------------------------------------
+    def record(self, onState, now):
+        self.lastChange = now
+        if onState:
+            self.starts.append(now)
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        return [self.lastChange, list(self.starts)]
+
+    #-------------------------------------------------------------------------------
+    def restore(self, snapshot):
+        if snapshot:
+            self.lastChange, starts = snapshot
+            self.starts = deque(starts)
+
+###############################################################################
+class RuntimeCounter(object):
+    # today's run time and starts for one piece of equipment, updated per transition
+
+    __slots__ = ('dayStart', 'onSince', 'runtime', 'cycles')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, dayStart, isOn, now):
+        self.dayStart = dayStart
+        self.onSince = now if isOn else None
+        self.runtime = 0.0
+        self.cycles = 0
+
+    #-------------------------------------------------------------------------------
+    def load(self, transitions, isOn, now):
+        # rebuild from today's (time, value) equipment records
+        self.onSince = None
+        self.runtime = 0.0
+        self.cycles = 0
+        first = True
+        for timestamp, value in transitions:
+            if value:
+                if self.onSince is None:
+                    self.onSince = timestamp
+                    self.cycles += 1
+            elif self.onSince is not None:
+                self.runtime += timestamp - self.onSince
+                self.onSince = None
+            elif first:
+                # on since before midnight
+                self.runtime += timestamp - self.dayStart
+            first = False
+        if isOn and self.onSince is None:
+            self.onSince = self.dayStart if first else now
+        elif not isOn:
+            self.onSince = None
+
+    #-------------------------------------------------------------------------------
+    def record(self, onState, now):
+        if onState:
+            if self.onSince is None:
+                self.onSince = now
+                self.cycles += 1
+        elif self.onSince is not None:
+            self.runtime += now - self.onSince
+            self.onSince = None
+
+    #-------------------------------------------------------------------------------
+    def rollover(self, dayStart):
+        # equipment running through midnight carries on without a new start
+        self.dayStart = dayStart
+        if self.onSince is not None:
+            self.onSince = dayStart
+        self.runtime = 0.0
+        self.cycles = 0
+
+    #-------------------------------------------------------------------------------
+    def runtimeAt(self, now):
+        if self.onSince is not None:
+            return self.runtime + now - self.onSince
+        return self.runtime
+
+###############################################################################
+class HysteresisController(object):
+    # switch equipment on the input as received
+
+    __slots__ = ()
+
+    #-------------------------------------------------------------------------------
+    def sample(self, value, now):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def controlValue(self, value, now):
+        return value
+
+    #-------------------------------------------------------------------------------
+    def slopeAt(self, value, now):
+        return 0.0
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        return None
+
+    #-------------------------------------------------------------------------------
+    def restore(self, snapshot, savedAt, now):
+        pass
+
+###############################################################################
+class PredictiveController(HysteresisController):
+    # switch equipment on the input projected ahead along its recent trend, so
+    # slow rooms stop short of overshooting.  The trend is a least squares fit
+    # over a fixed ring of samples, kept up to date with running sums.
+
+    __slots__ = ('size', 'horizon', 'times', 'values', 'count', 'index', 'origin',
+                 'sumT', 'sumV', 'sumTT', 'sumTV')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, size, horizon):
+        self.size = size
+        self.horizon = horizon
+        self.times = array('d', [0.0])*size
+        self.values = array('d', [0.0])*size
+        self.count = 0
+        self.index = 0
+        self.origin = None
+        self.sumT = self.sumV = self.sumTT = self.sumTV = 0.0
+
+    #-------------------------------------------------------------------------------
+    def sample(self, value, now):
+        if self.origin is None:
+            self.origin = now
+        index = self.index
+        if self.count == self.size:
+            t, v = self.times[index], self.values[index]
+            self.sumT -= t
+            self.sumV -= v
+            self.sumTT -= t*t
+            self.sumTV -= t*v
+        else:
+            self.count += 1
+
+        t = now - self.origin
+        self.times[index] = t
+        self.values[index] = value
+        self.sumT += t
+        self.sumV += value
+        self.sumTT += t*t
+        self.sumTV += t*value
+
+        self.index = (index + 1) % self.size
+        if self.index == 0:
+            self._rebase()
+
+    #-------------------------------------------------------------------------------
+    def _rebase(self):
+        # once per lap, shift times to start at the oldest sample and recompute
+        # the sums so rounding errors from the running updates do not build up
+        shift = self.times[self.index]
+        self.origin += shift
+        self.sumT = self.sumV = self.sumTT = self.sumTV = 0.0
+        for i in range(self.count):
+            t = self.times[i] - shift
+            v = self.values[i]
+            self.times[i] = t
+            self.sumT += t
+            self.sumV += v
+            self.sumTT += t*t
+            self.sumTV += t*v
+
+    #-------------------------------------------------------------------------------
+    def slopeAt(self, value, now):
+        # input units per second.  Once the input has been quiet for longer than
+        # the usual spacing of its samples, the current value counts as a sample
+        # at now, so a plateau flattens the trend instead of keeping the last one,
+        # and after a plateau as long as the whole window there is no trend.
+        n = self.count
+        if n < 2:
+            return 0.0
+        sumT, sumV, sumTT, sumTV = self.sumT, self.sumV, self.sumTT, self.sumTV
+        newest = self.times[self.index - 1]
+        oldest = self.times[(self.index - n) % self.size]
+        t = now - self.origin
+        if t - newest > newest - oldest:
+            return 0.0
+        if t - newest > (newest - oldest)/(n - 1):
+            n += 1
+            sumT += t
+            sumV += value
+            sumTT += t*t
+            sumTV += t*value
+        denominator = n*sumTT - sumT*sumT
+        if denominator <= 0.0:
+            return 0.0
+        return (n*sumTV - sumT*sumV)/denominator
+
+    #-------------------------------------------------------------------------------
+    def controlValue(self, value, now):
+        return value + self.slopeAt(value, now)*self.horizon
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        # (time, value) pairs, oldest first
+        first = self.index - self.count
+        return [[self.origin + self.times[i % self.size], self.values[i % self.size]] for i in range(first, self.index)]
+
+    #-------------------------------------------------------------------------------
+    def restore(self, snapshot, savedAt, now):
+        # a trend from before a long gap says nothing about the input now
+        if snapshot and now - savedAt <= max(self.horizon, 300.0):
+            for timestamp, value in snapshot[-self.size:]:
+                self.sample(value, timestamp)
+
+###############################################################################
+class WeeklySchedule(object):
+    # setpoint changes at fixed times of the week, written as entries like
+    #   "weekdays 06:30 heat=20 cool=25; weekdays 22:00 heat=17; sat,sun 08:00 heat=20"
+    # An entry may set one setpoint or both.
+
+    dayNames = ['mon','tue','wed','thu','fri','sat','sun']
+    dayGroups = {'daily':range(7), 'weekdays':range(5), 'weekends':range(5,7)}
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, text):
+        # weekday -> [(minute of day, heat, cool)] in time order
+        self.days = [list() for weekday in range(7)]
+        for entry in re.split(r'[;\n]', text):
+            fields = entry.lower().split()
+            if not fields:
+                continue
+            if len(fields) < 3:
+                raise ValueError(f'"{entry.strip()}" needs days, a time and a setpoint')
+            weekdays = self._parseDays(fields[0])
+            minute = self._parseTime(fields[1])
+            setpoints = {'heat':None, 'cool':None}
+            for field in fields[2:]:
+                key, sep, value = field.partition('=')
+                if key not in setpoints:
+                    raise ValueError(f'"{field}" is not heat=value or cool=value')
+                try:
+                    setpoints[key] = float(value)
+                except ValueError:
+                    raise ValueError(f'"{field}" is not heat=value or cool=value')
+            for weekday in weekdays:
+                self.days[weekday].append((minute, setpoints['heat'], setpoints['cool']))
+        if not any(self.days):
+            raise ValueError("Enter at least one setpoint change")
+        for changes in self.days:
+            changes.sort(key=lambda change: change[0])
+
+    #-------------------------------------------------------------------------------
+    def _parseDays(self, text):
+        if text in self.dayGroups:
+            return self.dayGroups[text]
+        weekdays = set()
+        for part in text.split(','):
+            first, sep, last = part.partition('-')
+            try:
+                start = self.dayNames.index(first[:3])
+                stop = self.dayNames.index(last[:3]) if sep else start
+            except ValueError:
+                raise ValueError(f'"{text}" is not a day, range or list of days')
+            weekdays.update((start + offset) % 7 for offset in range((stop - start) % 7 + 1))
+        return weekdays
+
+    #-------------------------------------------------------------------------------
+    def _parseTime(self, text):
+        hours, sep, minutes = text.partition(':')
+        try:
+            hours, minutes = int(hours), int(minutes or 0)
+        except ValueError:
+            raise ValueError(f'"{text}" is not a time like 06:30')
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(f'"{text}" is not a time like 06:30')
+        return hours*60 + minutes
+
+    #-------------------------------------------------------------------------------
+    def _changes(self, now, step):
+        # (time, heat, cool) for each change over a week and a day, forward or back from today
+        today = date.fromtimestamp(now)
+        for offset in range(0, 8*step, step):
+            day = today + timedelta(days=offset)
+            changes = self.days[day.weekday()]
+            midnight = datetime(day.year, day.month, day.day)
+            for minute, heat, cool in (changes if step > 0 else reversed(changes)):
+                yield (midnight + timedelta(minutes=minute)).timestamp(), heat, cool
+
+    #-------------------------------------------------------------------------------
+    def nextChange(self, now):
+        for when, heat, cool in self._changes(now, 1):
+            if when > now:
+                return when, heat, cool
+
+    #-------------------------------------------------------------------------------
+    def current(self, now):
+        # setpoints set by the most recent changes at or before now
+        setpoints = [None, None]
+        for when, heat, cool in self._changes(now, -1):
+            if when > now:
+                continue
+            if setpoints[0] is None:
+                setpoints[0] = heat
+            if setpoints[1] is None:
+                setpoints[1] = cool
+            if None not in setpoints:
+                break
+        return setpoints
+
+###############################################################################
+class UnistatState(object):
+    # local shadow of the thermostat states used by the control loop
+
+    __slots__ = (
+        'temperatureInput',
+        'setpointCool',
+        'setpointHeat',
+        'hvacOperationMode',
+        'hvacCoolerIsOn',
+        'hvacHeaterIsOn',
+        'hvacCoolerEnabled',
+        'hvacHeaterEnabled',
+        'supportsCool',
+        'supportsHeat',
+        )
+
+    # (attribute, device state key, type)
+    stateMap = (
+        ('temperatureInput',  'temperatureInput1', float),
+        ('setpointCool',      'setpointCool',      float),
+        ('setpointHeat',      'setpointHeat',      float),
+        ('hvacOperationMode', 'hvacOperationMode', int  ),
+        ('hvacCoolerIsOn',    'hvacCoolerIsOn',    bool ),
+        ('hvacHeaterIsOn',    'hvacHeaterIsOn',    bool ),
+        )
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, supportsCool, supportsHeat):
+        self.temperatureInput  = 0.0
+        self.setpointCool      = 0.0
+        self.setpointHeat      = 0.0
+        self.hvacOperationMode = indigo.kHvacMode.Off
+        self.hvacCoolerIsOn    = False
+        self.hvacHeaterIsOn    = False
+        self.supportsCool      = bool(supportsCool)
+        self.supportsHeat      = bool(supportsHeat)
+        self.updateEnabled()
+
+    #-------------------------------------------------------------------------------
+    def reconcile(self, states):
+        changed = False
+        for attr, key, valueType in self.stateMap:
+            try:
+                value = valueType(states[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if value != getattr(self, attr):
+                setattr(self, attr, value)
+                changed = True
+        if changed:
+            self.updateEnabled()
+        return changed
+
+    #-------------------------------------------------------------------------------
+    def updateEnabled(self):
+        self.hvacCoolerEnabled = self.supportsCool and self.hvacOperationMode in (indigo.kHvacMode.Cool, indigo.kHvacMode.HeatCool)
+        self.hvacHeaterEnabled = self.supportsHeat and self.hvacOperationMode in (indigo.kHvacMode.Heat, indigo.kHvacMode.HeatCool)
+
 ###############################################################################
 class UnistatBase(object):
 
     #-------------------------------------------------------------------------------
-    def __init__(self, instance, logger):
+    def __init__(self, instance, logger, commandQueue, scheduler):
         self.logger = logger
+        self.commandQueue = commandQueue
+        self.scheduler = scheduler
+        self.stats = Statistics()
 
         self.dev = instance
 
+        # only write props back when one of ours is missing or different
         self.props = instance.pluginProps
-        self.props['SupportsHvacOperationMode'] = True
-        self.props['SupportsHvacFanMode'] = False
-        self.props['ShowCoolHeatEquipmentStateUI'] = True
-        self.props['NumTemperatureInputs'] = 1
-        self.props['NumHumidityInputs'] = 0
-        if self.props != instance.pluginProps:
+        if any(self.props.get(key) != value for key, value in UNISTAT_PROPS.items()):
+            self.props.update(UNISTAT_PROPS)
             instance.replacePluginPropsOnServer(self.props)
 
+        # input sources as (device id, state key) pairs and variable ids
+        self.inputDeviceStates = list()
+        self.inputVariableIds = list()
+        self.aggregator = None
         if self.props.get('inputType','dev') == 'dev':
-            self.inputDeviceId = int(self.props['inputDevice'])
-            self.inputStateKey = self.props['inputState']
-            self.inputVariableId = None
+            self.inputDeviceStates.append((int(self.props['inputDevice']), self.props['inputState']))
         elif self.props.get('inputType','dev') == 'var':
-            self.inputDeviceId = None
-            self.inputStateKey = None
-            self.inputVariableId = int(self.props['inputVariable'])
+            self.inputVariableIds.append(int(self.props['inputVariable']))
+        elif self.props.get('inputType','dev') == 'multi':
+            stateKey = self.props.get('aggregateState','')
+            self.inputDeviceStates = [(int(deviceId), stateKey) for deviceId in self.props.get('aggregateDevices',[])]
+            self.inputVariableIds = [int(variableId) for variableId in self.props.get('aggregateVariables',[])]
+            self.aggregator = InputAggregator(self.props.get('aggregateFunction','mean'))
         else:
             self.logger.error(f'"{self.name}" input init failed')
             raise
@@ -243,6 +1840,31 @@ class UnistatBase(object):
         self.units = self.props.get('inputUnits','')
         self.decimals = int(self.props.get('inputDecimals', 1))
 
+        self.inputFilter = InputFilter(
+            minInterval = float(self.props.get('inputMinInterval', 0.0)),
+            threshold   = int(self.props.get('inputChangeSteps', 0)) * 10**-self.decimals,
+            )
+        self.coalesceInputs = self.props.get('inputTrailing', True)
+        self.inputTimer = None
+
+        minRunTime = float(self.props.get('minRunTime', 0.0))*60.0
+        minOffTime = float(self.props.get('minOffTime', 0.0))*60.0
+        maxCycles  = int(self.props.get('maxCyclesPerHour', 0))
+        self.coolGuard = CycleGuard(minRunTime, minOffTime, maxCycles)
+        self.heatGuard = CycleGuard(minRunTime, minOffTime, maxCycles)
+        self.guardTimer = None
+
+        # controlled devices that stopped responding
+        self.equipmentFaults = set()
+
+        if self.props.get('controlStrategy', 'hysteresis') == 'predictive':
+            self.controller = PredictiveController(
+                size    = int(self.props.get('predictiveSamples', 12)),
+                horizon = float(self.props.get('predictiveHorizon', 10.0))*60.0,
+                )
+        else:
+            self.controller = HysteresisController()
+
         self.modeNameMap = {
             indigo.kHvacMode.Off        : self.props.get('modeNameOff',  'Off' ),
             indigo.kHvacMode.Heat       : self.props.get('modeNameHeat', 'Heat'),
@@ -250,53 +1872,419 @@ class UnistatBase(object):
             indigo.kHvacMode.HeatCool   : self.props.get('modeNameAuto', 'Auto'),
             }
 
-        self.requestTemperature()
+        self.state = UnistatState(self.props.get('SupportsCoolSetpoint', False), self.props.get('SupportsHeatSetpoint', False))
+        self.state.reconcile(instance.states)
+
+        # state changes are collected during an evaluation and written together
+        self.pendingStates = dict()
+        self.pendingEchoes = deque(maxlen=16)
+
+        # last known values of the equipment protection and usage states
+        self.extraStates = {key:instance.states.get(key) for key in [
+            'hvacCoolerNextChange', 'hvacCoolerChangePending', 'hvacHeaterNextChange', 'hvacHeaterChangePending',
+            'hvacCoolerRuntimeToday', 'hvacCoolerCyclesToday', 'hvacHeaterRuntimeToday', 'hvacHeaterCyclesToday',
+            'inputTrend', 'scheduleHoldUntil', 'scheduleNextChange']}
+
+        # today's equipment usage, and the history file once the plugin attaches one
+        now = time.time()
+        self.coolUsage = RuntimeCounter(startOfDay(now), self.state.hvacCoolerIsOn, now)
+        self.heatUsage = RuntimeCounter(startOfDay(now), self.state.hvacHeaterIsOn, now)
+        self.nextDayStart = startOfDay(now, 1)
+        self.dayTimer = self.scheduler.callAt(self.nextDayStart, self._dayTimerFired)
+        self.usageTimer = None
+        self.usageChanged = True
+        self.history = None
+
+        # set while the plugin evaluates all unistats together
+        self.batch = None
+        self.batchRow = None
+
+        # weekly setpoint schedule, and a temporary hold after manual changes
+        self.schedule = None
+        if self.props.get('scheduleEnabled', False):
+            try:
+                self.schedule = WeeklySchedule(self.props.get('schedule',''))
+            except ValueError as e:
+                self.logError(f'"{self.name}" schedule not valid: {e}')
+        self.holdDuration = 0.0
+        if self.props.get('scheduleHold','next') == 'hours':
+            self.holdDuration = float(self.props.get('holdDuration', 2.0))*3600.0
+        try:
+            self.holdUntil = parseTimeField(instance.states.get('scheduleHoldUntil') or '')
+        except ValueError:
+            self.holdUntil = None
+        self.scheduleTimer = None
+        self.holdTimer = None
+        if self.schedule:
+            self.startSchedule()
+
+    #-------------------------------------------------------------------------------
+    def startSchedule(self):
+        now = time.time()
+        if self.holdUntil and self.holdUntil > now:
+            self.holdTimer = self.scheduler.callAt(self.holdUntil, self._holdExpired)
+        else:
+            self.holdUntil = None
+            self._applySchedule(*self.schedule.current(now))
+        self._queueExtraState('scheduleHoldUntil', formatTime(self.holdUntil) if self.holdUntil else '')
+        self._scheduleNext(now)
+
+    #-------------------------------------------------------------------------------
+    def _scheduleNext(self, now):
+        when, heat, cool = self.schedule.nextChange(now)
+        self.scheduleTimer = self.scheduler.callAt(when, self._scheduleTimerFired, heat, cool)
+        self._queueExtraState('scheduleNextChange', formatTime(when))
+
+    #-------------------------------------------------------------------------------
+    def _scheduleTimerFired(self, heat, cool):
+        self.scheduleTimer = None
+        now = time.time()
+        if not self.holdUntil:
+            self._applySchedule(heat, cool)
+        self._scheduleNext(now)
+        self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def _applySchedule(self, heat, cool):
+        if heat is not None and self.state.supportsHeat:
+            self.setpointHeat = heat
+        if cool is not None and self.state.supportsCool:
+            self.setpointCool = cool
+
+    #-------------------------------------------------------------------------------
+    def startHold(self):
+        # keep manually set setpoints until the next scheduled change, or for a fixed time
+        if not self.schedule:
+            return
+        now = time.time()
+        if self.holdDuration:
+            self.holdUntil = now + self.holdDuration
+        else:
+            self.holdUntil = self.schedule.nextChange(now)[0]
+        if self.holdTimer:
+            self.holdTimer.cancel()
+        self.holdTimer = self.scheduler.callAt(self.holdUntil, self._holdExpired)
+        self._queueExtraState('scheduleHoldUntil', formatTime(self.holdUntil))
+        self.logger.info(f'"{self.name}" schedule on hold until {formatTime(self.holdUntil)}')
+
+    #-------------------------------------------------------------------------------
+    def endHold(self):
+        if self.holdTimer:
+            self.holdTimer.cancel()
+            self.holdTimer = None
+        if self.holdUntil:
+            self.holdUntil = None
+            self._queueExtraState('scheduleHoldUntil', '')
+            self.logger.info(f'"{self.name}" schedule resumed')
+        self._applySchedule(*self.schedule.current(time.time()))
+
+    #-------------------------------------------------------------------------------
+    def _holdExpired(self):
+        self.holdTimer = None
+        self.endHold()
+        self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def attachHistory(self, path, capacity):
+        # open (or reopen at a new capacity) the history file and load today's usage from it
+        if self.history:
+            self.history.close()
+            self.history = None
+        self.history = history = HistoryFile(path, capacity)
+        now = time.time()
+        transitions = {COOLER:list(), HEATER:list()}
+        for timestamp, kind, value in history.records(self.coolUsage.dayStart, kinds=(COOLER, HEATER)):
+            transitions[kind].append((timestamp, value))
+        self.coolUsage.load(transitions[COOLER], self.state.hvacCoolerIsOn, now)
+        self.heatUsage.load(transitions[HEATER], self.state.hvacHeaterIsOn, now)
+        self.usageChanged = True
+        self._scheduleUsageRefresh(now)
 
     #-------------------------------------------------------------------------------
-    def requestTemperature(self):
-        if self.inputDeviceId:
+    def requestTemperature(self, devices=None, variables=None):
+        # devices and variables may be prefetched by the caller
+        devices = devices or indigo.devices
+        variables = variables or indigo.variables
+        value = None
+        for deviceId, stateKey in self.inputDeviceStates:
             try:
-                self.temperatureInput = indigo.devices[self.inputDeviceId].states[self.inputStateKey]
+                value = self._sourceUpdated((deviceId, stateKey), devices[deviceId].states[stateKey])
             except KeyError:
-                self.logger.error(f'Input device {self.inputDeviceId} does not exist.  Reconfigure "{self.name}".')
-        elif self.inputVariableId:
+                self.logError(f'Input device {deviceId} does not exist.  Reconfigure "{self.name}".')
+        for variableId in self.inputVariableIds:
             try:
-                self.temperatureInput = indigo.variables[self.inputVariableId].value
+                value = self._sourceUpdated(variableId, variables[variableId].value)
             except KeyError:
-                self.logger.error(f'Input variable {self.inputVariableId} does not exist.  Reconfigure "{self.name}".')
+                self.logError(f'Input variable {variableId} does not exist.  Reconfigure "{self.name}".')
+        if value is not None:
+            self.temperatureInput = value
+        self.inputFilter.reset(self.state.temperatureInput, time.time())
+        self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        # controller state that is not kept in device states
+        return {
+            'time'       : time.time(),
+            'coolGuard'  : self.coolGuard.snapshot(),
+            'heatGuard'  : self.heatGuard.snapshot(),
+            'controller' : self.controller.snapshot(),
+            }
+
+    #-------------------------------------------------------------------------------
+    def restore(self, snapshot):
+        # carry equipment protection and trend history over a restart, so the
+        # first evaluation decides as the last one before the restart would have
+        self.coolGuard.restore(snapshot.get('coolGuard'))
+        self.heatGuard.restore(snapshot.get('heatGuard'))
+        self.controller.restore(snapshot.get('controller'), snapshot.get('time', 0.0), time.time())
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        if self.inputTimer:
+            self.inputTimer.cancel()
+            self.inputTimer = None
+        if self.guardTimer:
+            self.guardTimer.cancel()
+            self.guardTimer = None
+        if self.dayTimer:
+            self.dayTimer.cancel()
+            self.dayTimer = None
+        if self.usageTimer:
+            self.usageTimer.cancel()
+            self.usageTimer = None
+        if self.scheduleTimer:
+            self.scheduleTimer.cancel()
+            self.scheduleTimer = None
+        if self.holdTimer:
+            self.holdTimer.cancel()
+            self.holdTimer = None
+        if self.history:
+            self.history.close()
 
     #-------------------------------------------------------------------------------
     def selfDeviceUpdated(self, newDev):
         self.dev = newDev
-        self.logger.debug(f'"{self.name}" evaluate equipment state [in:{self.temperatureInput} hi:{self.setpointCool}, lo:{self.setpointHeat}, hb:{self.halfband}]')
-
-        # evaluate cool equipment state
-        if self.hvacCoolerEnabled:
-            if self.temperatureInput > self.setpointCool + self.halfband:
-                self.hvacCoolerIsOn = True
-            elif self.temperatureInput <= self.setpointCool - self.halfband:
-                self.hvacCoolerIsOn = False
-        else:
-            self.hvacCoolerIsOn = False
-
-        # evaluate heat equipment state
-        if self.hvacHeaterEnabled:
-            if self.temperatureInput < self.setpointHeat - self.halfband:
-                self.hvacHeaterIsOn = True
-            elif self.temperatureInput >= self.setpointHeat + self.halfband:
-                self.hvacHeaterIsOn = False
-        else:
-            self.hvacHeaterIsOn = False
+        # ignore updates caused by our own writes, which are already in the shadow state
+        if self.isEcho(newDev.states):
+            return
+        if self.state.reconcile(newDev.states):
+            self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def evaluate(self):
+        startTime = time.perf_counter()
+        state = self.state
+        self.logger.debug('"%s" evaluate equipment state [in:%s hi:%s, lo:%s, hb:%s]',
+            self.name, state.temperatureInput, state.setpointCool, state.setpointHeat, self.halfband)
+
+        now = time.time()
+        controlValue = self.controller.controlValue(state.temperatureInput, now)
+        if controlValue != state.temperatureInput:
+            self.logger.debug('"%s" projected input %.*f%s', self.name, self.decimals, controlValue, self.units)
+        self._queueTrend(now)
+        if self.batch:
+            # decided together with the other unistats on the next batch tick
+            self.batch.mark(self, controlValue)
+            return
+
+        # evaluate equipment state
+        coolerIsOn = coolerState(state.hvacCoolerIsOn, state.hvacCoolerEnabled, controlValue, state.setpointCool, self.halfband)
+        heaterIsOn = heaterState(state.hvacHeaterIsOn, state.hvacHeaterEnabled, controlValue, state.setpointHeat, self.halfband)
+        self.applyEvaluation(coolerIsOn, heaterIsOn, startTime)
+
+    #-------------------------------------------------------------------------------
+    def applyEvaluation(self, coolerIsOn, heaterIsOn, startTime):
+        state = self.state
+
+        # apply equipment protection
+        now = time.time()
+        self.hvacCoolerIsOn = self._guardTransition(self.coolGuard, 'hvacCooler', state.hvacCoolerIsOn, coolerIsOn, now)
+        self.hvacHeaterIsOn = self._guardTransition(self.heatGuard, 'hvacHeater', state.hvacHeaterIsOn, heaterIsOn, now)
+        self._queueUsageStates(now)
+
+        self.stats.count('evaluations')
+        self.stats.timing('evaluation', time.perf_counter() - startTime)
+        self.flushStates()
+
+    #-------------------------------------------------------------------------------
+    def _guardTransition(self, guard, prefix, currentState, newState, now):
+        if newState == currentState:
+            self._queueExtraState(prefix+'ChangePending', False)
+            return currentState
+
+        allowedAt = guard.allowedAt(newState, now)
+        if allowedAt > now:
+            # defer until the transition is allowed
+            self._queueExtraState(prefix+'ChangePending', True)
+            if not (self.guardTimer and self.guardTimer.when <= allowedAt):
+                if self.guardTimer:
+                    self.guardTimer.cancel()
+                self.guardTimer = self.scheduler.callAt(allowedAt, self._guardTimerFired)
+                self.logger.debug('"%s" equipment change deferred until %s', self.name, formatTime(allowedAt))
+            return currentState
+
+        guard.record(newState, now)
+        self._queueExtraState(prefix+'ChangePending', False)
+        self._queueExtraState(prefix+'NextChange', formatTime(guard.allowedAt(not newState, now)))
+        return newState
 
     #-------------------------------------------------------------------------------
-    def inputDeviceUpdated(self, newDev):
-        if newDev.id == self.inputDeviceId:
-            self.temperatureInput = newDev.states[self.inputStateKey]
+    def _guardTimerFired(self):
+        self.guardTimer = None
+        self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def _queueExtraState(self, key, value, uiValue=None):
+        if value != self.extraStates.get(key):
+            self.extraStates[key] = value
+            self.queueState(key, value, uiValue)
+
+    #-------------------------------------------------------------------------------
+    def _queueTrend(self, now):
+        if isinstance(self.controller, PredictiveController):
+            trend = round(self.controller.slopeAt(self.state.temperatureInput, now)*3600.0, self.decimals)
+            self._queueExtraState('inputTrend', trend, uiValue=f'{trend:+.{self.decimals}f}{self.units}/h')
+
+    #-------------------------------------------------------------------------------
+    def _queueUsageStates(self, now):
+        if now >= self.nextDayStart:
+            dayStart = startOfDay(now)
+            self.coolUsage.rollover(dayStart)
+            self.heatUsage.rollover(dayStart)
+            self.nextDayStart = startOfDay(now, 1)
+            self.usageChanged = True
+        elif not self.usageChanged and self.coolUsage.onSince is None and self.heatUsage.onSince is None:
+            return
+        self.usageChanged = False
+        for usage, prefix in ((self.coolUsage, 'hvacCooler'), (self.heatUsage, 'hvacHeater')):
+            runtime = usage.runtimeAt(now)
+            if int(runtime//60) != self.extraStates[prefix+'RuntimeToday']:
+                self._queueExtraState(prefix+'RuntimeToday', int(runtime//60), uiValue=formatDuration(runtime))
+            self._queueExtraState(prefix+'CyclesToday', usage.cycles)
+
+    #-------------------------------------------------------------------------------
+    def _dayTimerFired(self):
+        now = time.time()
+        self._queueUsageStates(now)
+        self.flushStates()
+        self.dayTimer = self.scheduler.callAt(self.nextDayStart, self._dayTimerFired)
+
+    #-------------------------------------------------------------------------------
+    def _recordEquipment(self, usage, kind, onState):
+        now = time.time()
+        usage.record(onState, now)
+        self.usageChanged = True
+        if self.history:
+            self.history.append(now, kind, float(onState))
+        self._scheduleUsageRefresh(now)
+
+    #-------------------------------------------------------------------------------
+    def _scheduleUsageRefresh(self, now):
+        # while equipment runs, update the runtime states as each minute passes,
+        # since a steady input brings no evaluations to do it
+        running = [usage.runtimeAt(now) for usage in (self.coolUsage, self.heatUsage) if usage.onSince is not None]
+        if self.usageTimer:
+            self.usageTimer.cancel()
+            self.usageTimer = None
+        if running:
+            self.usageTimer = self.scheduler.callAt(now + min(60.0 - runtime % 60.0 for runtime in running), self._usageTimerFired)
+
+    #-------------------------------------------------------------------------------
+    def _usageTimerFired(self):
+        self.usageTimer = None
+        now = time.time()
+        self._queueUsageStates(now)
+        self.flushStates()
+        self._scheduleUsageRefresh(now)
+
+    #-------------------------------------------------------------------------------
+    def inputDeviceUpdated(self, newDev, stateKey):
+        self.stats.count('inputEvents')
+        value = self._sourceUpdated((newDev.id, stateKey), newDev.states[stateKey])
+        if value is not None:
+            self.inputReceived(value)
 
     #-------------------------------------------------------------------------------
     def inputVariableUpdated(self, newVar):
-        if newVar.id == self.inputVariableId:
-            self.temperatureInput = newVar.value
+        self.stats.count('inputEvents')
+        value = self._sourceUpdated(newVar.id, newVar.value)
+        if value is not None:
+            self.inputReceived(value)
+
+    #-------------------------------------------------------------------------------
+    def _sourceUpdated(self, source, value):
+        # single inputs pass straight through, multiple inputs are aggregated
+        if not self.aggregator:
+            return value
+        try:
+            self.aggregator.update(source, float(value))
+        except (TypeError, ValueError):
+            self.logger.debug('"%s" ignoring invalid input "%s" from %s', self.name, value, source)
+            self.aggregator.remove(source)
+        return self.aggregator.value
+
+    #-------------------------------------------------------------------------------
+    def inputReceived(self, value):
+        try:
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError
+        except (TypeError, ValueError):
+            self.logError(f'"{self.name}" received invalid input "{value}" ({type(value)})')
+            return
+        inputFilter = self.inputFilter
+        if inputFilter.offer(value, time.time()):
+            self.temperatureInput = value
+            self.evaluate()
+            return
+        if not self.coalesceInputs and (inputFilter.pendingValue is not None or self.state.temperatureInput != inputFilter.lastValue):
+            # show and record samples held back by the interval, only the equipment decision waits
+            self.temperatureInput = value
+            self.flushStates()
+        if inputFilter.pendingValue is not None and not self.inputTimer:
+            self.inputTimer = self.scheduler.callAt(inputFilter.nextTime, self._inputTimerFired)
+
+    #-------------------------------------------------------------------------------
+    def _inputTimerFired(self):
+        self.inputTimer = None
+        value = self.inputFilter.pendingValue
+        if value is not None:
+            self.inputFilter.accept(value, time.time())
+            self.temperatureInput = value
+            self.evaluate()
+
+    #-------------------------------------------------------------------------------
+    def queueState(self, key, value, uiValue=None):
+        stateItem = {'key':key, 'value':value}
+        if uiValue is not None:
+            stateItem['uiValue'] = uiValue
+        self.pendingStates[key] = stateItem
+
+    #-------------------------------------------------------------------------------
+    def flushStates(self):
+        if self.pendingStates:
+            startTime = time.perf_counter()
+            self.pendingEchoes.append({key:item['value'] for key, item in self.pendingStates.items()})
+            self.dev.updateStatesOnServer(list(self.pendingStates.values()), clearErrorState=not self.equipmentFaults)
+            self.pendingStates.clear()
+            self.stats.count('stateWrites')
+            self.stats.timing('stateWrite', time.perf_counter() - startTime)
+
+    #-------------------------------------------------------------------------------
+    def isEcho(self, states):
+        for index, written in enumerate(self.pendingEchoes):
+            if all(states.get(key) == value for key, value in written.items()):
+                for i in range(index+1):
+                    self.pendingEchoes.popleft()
+                return True
+        self.pendingEchoes.clear()
+        return False
+
+    #-------------------------------------------------------------------------------
+    def logError(self, message):
+        self.stats.count('errors')
+        self.logger.error(message)
 
     #-------------------------------------------------------------------------------
     def getModeName(self, mode=None):
@@ -307,97 +2295,137 @@ class UnistatBase(object):
     # properties
     #-------------------------------------------------------------------------------
     def _temperatureInputGet(self):
-        return self.dev.states['temperatureInput1']
+        return self.state.temperatureInput
     def _temperatureInputSet(self, temp):
-        if temp != self.temperatureInput:
-            try:
-                self.dev.updateStateOnServer('temperatureInput1', float(temp), uiValue=f'{float(temp):.{self.decimals}f}{self.units}')
-                self.logger.debug(f'"{self.name}" received input {float(temp):.{self.decimals}f}{self.units}')
-            except ValueError:
-                self.logger.error(f'"{self.name}" received invalid input "{temp}" ({type(temp)})')
+        try:
+            temp = float(temp)
+            if not math.isfinite(temp):
+                raise ValueError
+        except (TypeError, ValueError):
+            self.logError(f'"{self.name}" received invalid input "{temp}" ({type(temp)})')
+            return
+        now = time.time()
+        self.controller.sample(temp, now)
+        if temp != self.state.temperatureInput:
+            self.state.temperatureInput = temp
+            if self.history:
+                self.history.append(now, INPUT, temp)
+            self.queueState('temperatureInput1', temp, uiValue=f'{temp:.{self.decimals}f}{self.units}')
+            self.logger.debug('"%s" received input %.*f%s', self.name, self.decimals, temp, self.units)
+        self._queueTrend(now)
     temperatureInput = property(_temperatureInputGet,_temperatureInputSet)
 
     #-------------------------------------------------------------------------------
     def _hvacOperationModeGet(self):
-        return self.dev.states['hvacOperationMode']
+        return self.state.hvacOperationMode
     def _hvacOperationModeSet(self, mode):
         if mode in range(4):
-            if mode != self.hvacOperationMode:
-                self.dev.updateStateOnServer('hvacOperationMode', mode, uiValue=self.getModeName(mode))
+            if mode != self.state.hvacOperationMode:
+                self.state.hvacOperationMode = mode
+                self.state.updateEnabled()
+                self.queueState('hvacOperationMode', mode, uiValue=self.getModeName(mode))
                 self.logger.info(f'"{self.name}" mode now {self.getModeName(mode)}')
         else:
-            self.logger.error(f'"{self.name}" program mode not supported')
+            self.logError(f'"{self.name}" program mode not supported')
     hvacOperationMode = property(_hvacOperationModeGet,_hvacOperationModeSet)
 
     #-------------------------------------------------------------------------------
     def _setpointCoolGet(self):
-        if self.props['SupportsCoolSetpoint']:
-            return self.dev.states['setpointCool']
+        if self.state.supportsCool:
+            return self.state.setpointCool
         else:
             return 0.0
     def _setpointCoolSet(self, setpoint):
-        if self.props['SupportsCoolSetpoint']:
-            if setpoint != self.setpointCool:
-                self.dev.updateStateOnServer('setpointCool', setpoint, uiValue=f'{float(setpoint):.{self.decimals}f}{self.units}')
+        if self.state.supportsCool:
+            setpoint = float(setpoint)
+            if setpoint != self.state.setpointCool:
+                self.state.setpointCool = setpoint
+                self.queueState('setpointCool', setpoint, uiValue=f'{setpoint:.{self.decimals}f}{self.units}')
                 self.logger.info(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Cool)} setpoint now {setpoint}{self.units}')
         else:
-            self.logger.error(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Cool)} setpoint not supported')
+            self.logError(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Cool)} setpoint not supported')
     setpointCool = property(_setpointCoolGet,_setpointCoolSet)
 
     #-------------------------------------------------------------------------------
     def _setpointHeatGet(self):
-        if self.props['SupportsHeatSetpoint']:
-            return self.dev.states['setpointHeat']
+        if self.state.supportsHeat:
+            return self.state.setpointHeat
         else:
             return 0.0
     def _setpointHeatSet(self, setpoint):
-        if self.props['SupportsHeatSetpoint']:
-            if setpoint != self.setpointHeat:
-                self.dev.updateStateOnServer('setpointHeat', setpoint, uiValue=f'{float(setpoint):.{self.decimals}f}{self.units}')
+        if self.state.supportsHeat:
+            setpoint = float(setpoint)
+            if setpoint != self.state.setpointHeat:
+                self.state.setpointHeat = setpoint
+                self.queueState('setpointHeat', setpoint, uiValue=f'{setpoint:.{self.decimals}f}{self.units}')
                 self.logger.info(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Heat)} setpoint now {setpoint}{self.units}')
         else:
-            self.logger.error(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Heat)} setpoint not supported')
+            self.logError(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Heat)} setpoint not supported')
     setpointHeat = property(_setpointHeatGet,_setpointHeatSet)
 
     #-------------------------------------------------------------------------------
     def _hvacCoolerIsOnGet(self):
-        return self.dev.states['hvacCoolerIsOn']
+        return self.state.hvacCoolerIsOn
     def _hvacCoolerIsOnSet(self, onState):
-        if onState != self.hvacCoolerIsOn:
-            self.dev.updateStateOnServer('hvacCoolerIsOn', onState)
+        if onState != self.state.hvacCoolerIsOn:
+            self.state.hvacCoolerIsOn = onState
+            self.queueState('hvacCoolerIsOn', onState)
             self.logger.info(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Cool)} equipment now {["off","on"][onState]}')
+            self._recordEquipment(self.coolUsage, COOLER, onState)
             self.setCoolerEquipmentState(onState)
     hvacCoolerIsOn = property(_hvacCoolerIsOnGet,_hvacCoolerIsOnSet)
 
     #-------------------------------------------------------------------------------
     def _hvacHeaterIsOnGet(self):
-        return self.dev.states['hvacHeaterIsOn']
+        return self.state.hvacHeaterIsOn
     def _hvacHeaterIsOnSet(self, onState):
-        if onState != self.hvacHeaterIsOn:
-            self.dev.updateStateOnServer('hvacHeaterIsOn', onState)
-            self.logger.info(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Cool)} equipment now {["off","on"][onState]}')
+        if onState != self.state.hvacHeaterIsOn:
+            self.state.hvacHeaterIsOn = onState
+            self.queueState('hvacHeaterIsOn', onState)
+            self.logger.info(f'"{self.name}" {self.getModeName(indigo.kHvacMode.Heat)} equipment now {["off","on"][onState]}')
+            self._recordEquipment(self.heatUsage, HEATER, onState)
             self.setHeaterEquipmentState(onState)
     hvacHeaterIsOn = property(_hvacHeaterIsOnGet,_hvacHeaterIsOnSet)
 
     #-------------------------------------------------------------------------------
     @property
     def hvacCoolerEnabled(self):
-        return (self.props['SupportsCoolSetpoint'] and
-               (self.dev.states['hvacOperationModeIsCool'] or self.dev.states['hvacOperationModeIsAuto'])
-               )
+        return self.state.hvacCoolerEnabled
 
     #-------------------------------------------------------------------------------
     @property
     def hvacHeaterEnabled(self):
-        return (self.props['SupportsHeatSetpoint'] and
-               (self.dev.states['hvacOperationModeIsHeat'] or self.dev.states['hvacOperationModeIsAuto'])
-               )
+        return self.state.hvacHeaterEnabled
 
     #-------------------------------------------------------------------------------
     @property
     def name(self):
         return self.dev.name
 
+    #-------------------------------------------------------------------------------
+    @property
+    def id(self):
+        return self.dev.id
+
+    #-------------------------------------------------------------------------------
+    @property
+    def equipmentDeviceIds(self):
+        return ()
+
+    #-------------------------------------------------------------------------------
+    def equipmentConfirmed(self, deviceId):
+        if deviceId in self.equipmentFaults:
+            self.equipmentFaults.discard(deviceId)
+            if not self.equipmentFaults:
+                self.dev.setErrorStateOnServer(None)
+
+    #-------------------------------------------------------------------------------
+    def equipmentFailed(self, deviceId):
+        if deviceId not in self.equipmentFaults:
+            self.equipmentFaults.add(deviceId)
+            self.stats.count('errors')
+            self.dev.setErrorStateOnServer('no response')
+
     #-------------------------------------------------------------------------------
     # abstract methods
     #-------------------------------------------------------------------------------
@@ -412,8 +2440,9 @@ class UnistatBase(object):
 class DeviceUnistat(UnistatBase):
 
     #-------------------------------------------------------------------------------
-    def __init__(self, instance, logger):
-        super(DeviceUnistat, self).__init__(instance, logger)
+    def __init__(self, instance, logger, commandQueue, scheduler, registry):
+        super(DeviceUnistat, self).__init__(instance, logger, commandQueue, scheduler)
+        self.registry = registry
 
         self.reverseMode = self.props.get('deviceControlMode','normal') != 'normal'
 
@@ -422,38 +2451,69 @@ class DeviceUnistat(UnistatBase):
 
         self.speedControlIndex    = [0, int(self.props.get('speedControlIndex', 3))]
         self.dimmerControlLevel   = [0, int(self.props.get('dimmerControlLevel', 100))]
-        self.relayControlFunction = [indigo.device.turnOff, indigo.device.turnOn]
 
-    #-------------------------------------------------------------------------------
-    def setCoolerEquipmentState(self, onState):
-        self._setEquipmentState(self.coolDeviceIdList, onState)
+        self.coolPlan = self.heatPlan = ()
+        self.buildControlPlans()
 
     #-------------------------------------------------------------------------------
-    def setHeaterEquipmentState(self, onState):
-        self._setEquipmentState(self.heatDeviceIdList, onState)
+    def buildControlPlans(self):
+        self.releaseControlPlans()
+        self.coolPlan = self._buildControlPlan(self.coolDeviceIdList)
+        self.heatPlan = self._buildControlPlan(self.heatDeviceIdList)
+        self.registry.register(self, 'cool', self.coolPlan, self.state.hvacCoolerIsOn)
+        self.registry.register(self, 'heat', self.heatPlan, self.state.hvacHeaterIsOn)
 
     #-------------------------------------------------------------------------------
-    def _setEquipmentState(self, deviceIdList, onState):
-        if self.reverseMode: onState = not onState
+    def releaseControlPlans(self):
+        self.registry.unregister(self, 'cool', self.coolPlan)
+        self.registry.unregister(self, 'heat', self.heatPlan)
 
+    #-------------------------------------------------------------------------------
+    def _buildControlPlan(self, deviceIdList):
+        # list of (device id, command, on value, off value)
+        plan = list()
         for deviceId in deviceIdList:
             try:
                 device = indigo.devices[deviceId]
-                if isinstance(device, indigo.SpeedControlDevice):
-                    indigo.speedcontrol.setSpeedIndex(device, self.speedControlIndex[onState])
-                elif isinstance(device, indigo.DimmerDevice):
-                    indigo.dimmer.setBrightness(device, self.dimmerControlLevel[onState])
-                else:
-                    self.relayControlFunction[onState](device)
             except KeyError:
-                self.logger.error(f'Device {deviceId} does not exist.  Reconfigure "{self.name}".')
+                self.logError(f'Device {deviceId} does not exist.  Reconfigure "{self.name}".')
+                continue
+            if isinstance(device, indigo.SpeedControlDevice):
+                command, values = indigo.speedcontrol.setSpeedIndex, self.speedControlIndex
+            elif isinstance(device, indigo.DimmerDevice):
+                command, values = indigo.dimmer.setBrightness, self.dimmerControlLevel
+            else:
+                command, values = setRelayState, [False, True]
+            if self.reverseMode:
+                plan.append((deviceId, command, values[0], values[1]))
+            else:
+                plan.append((deviceId, command, values[1], values[0]))
+        return plan
+
+    #-------------------------------------------------------------------------------
+    def setCoolerEquipmentState(self, onState):
+        self.registry.setDemand(self, 'cool', self.coolPlan, onState)
+
+    #-------------------------------------------------------------------------------
+    def setHeaterEquipmentState(self, onState):
+        self.registry.setDemand(self, 'heat', self.heatPlan, onState)
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        super(DeviceUnistat, self).stop()
+        self.releaseControlPlans()
+
+    #-------------------------------------------------------------------------------
+    @property
+    def equipmentDeviceIds(self):
+        return set(self.coolDeviceIdList + self.heatDeviceIdList)
 
 ###############################################################################
 class ActionGroupUnistat(UnistatBase):
 
     #-------------------------------------------------------------------------------
-    def __init__(self, instance, logger):
-        super(ActionGroupUnistat, self).__init__(instance, logger)
+    def __init__(self, instance, logger, commandQueue, scheduler):
+        super(ActionGroupUnistat, self).__init__(instance, logger, commandQueue, scheduler)
 
         self.coolerOn  = zint(self.props.get('coolerOnActionGroup',0))
         self.coolerOff = zint(self.props.get('coolerOffActionGroup',0))
@@ -462,17 +2522,15 @@ class ActionGroupUnistat(UnistatBase):
 
     #-------------------------------------------------------------------------------
     def setCoolerEquipmentState(self, onState):
-        if onState:
-            self._executeAction(self.coolerOn)
-        else:
-            self._executeAction(self.coolerOff)
+        actionId = self.coolerOn if onState else self.coolerOff
+        self.commandQueue.enqueue((self.id, 'cool'), self._executeAction, actionId, stats=self.stats)
+        self.stats.count('equipmentCommands')
 
     #-------------------------------------------------------------------------------
     def setHeaterEquipmentState(self, onState):
-        if onState:
-            self._executeAction(self.heaterOn)
-        else:
-            self._executeAction(self.heaterOff)
+        actionId = self.heaterOn if onState else self.heaterOff
+        self.commandQueue.enqueue((self.id, 'heat'), self._executeAction, actionId, stats=self.stats)
+        self.stats.count('equipmentCommands')
 
     #-------------------------------------------------------------------------------
     def _executeAction(self, actionId):
@@ -480,7 +2538,7 @@ class ActionGroupUnistat(UnistatBase):
             try:
                 indigo.actionGroup.execute(actionId)
             except KeyError:
-                self.logger.error(f'Action Group {actionId} does not exist.  Reconfigure device "{self.name}".')
+                self.logError(f'Action Group {actionId} does not exist.  Reconfigure device "{self.name}".')
 
 
 ################################################################################
@@ -490,6 +2548,46 @@ def zint(value):
     try: return int(value)
     except: return 0
 
+def unsubscribe(subscriberDict, key, subscriber):
+    subscribers = subscriberDict.get(key)
+    if subscribers and subscriber in subscribers:
+        subscribers.remove(subscriber)
+        if not subscribers:
+            del subscriberDict[key]
+
+def formatTime(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+def startOfDay(timestamp, days=0):
+    # local midnight starting the day of timestamp, offset by whole days
+    day = date.fromtimestamp(timestamp) + timedelta(days=days)
+    return datetime(day.year, day.month, day.day).timestamp()
+
+def formatDuration(seconds):
+    minutes = int(seconds//60)
+    return f'{minutes//60}:{minutes%60:02d}'
+
+def parseTimeField(text):
+    # blank for no limit, otherwise an ISO 8601 date and optional time
+    text = text.strip()
+    if not text:
+        return None
+    return datetime.fromisoformat(text).timestamp()
+
+def equipmentValue(device):
+    # current value of a controlled device, comparable to its control plan values
+    if isinstance(device, indigo.SpeedControlDevice):
+        return device.speedIndex
+    elif isinstance(device, indigo.DimmerDevice):
+        return device.brightness
+    return device.onState
+
+def setRelayState(device, onState):
+    if onState:
+        indigo.device.turnOn(device)
+    else:
+        indigo.device.turnOff(device)
+
 def validateTextFieldNumber(rawInput, numType=float, zero=True, negative=True):
     try:
         num = numType(rawInput)
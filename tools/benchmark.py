@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Load benchmark for the Unistat plugin against the stand-in indigo host.
+#
+#   python tools/benchmark.py --unistats 500 --devices 2000 --events 50000 --rate 5000
+#   python tools/benchmark.py --batch 0.5     # batch evaluation every 0.5 s (needs NumPy)
+#   python tools/benchmark.py --min-interval 2 --rate 5000
+#
+# Builds a site of sensor devices, variables and unistats (a mix of device
+# and action group unistats, each with its own equipment), then streams
+# synthetic input changes into Plugin.deviceUpdated / variableUpdated from the
+# main thread while runConcurrentThread sends equipment commands on its own
+# thread, as in Indigo.  Sensor updates are a random walk around the
+# setpoints, mixed with battery-only updates and changes to devices nobody
+# watches.
+#
+# Reports dispatch throughput, latency from an input change to the resulting
+# equipment command (p50/p99/max), and server state writes per input event.
+# Once the run settles, every unistat input is checked against its source, so
+# input changes held back by the minimum interval and never applied show up
+# as stale inputs.
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+
+TOOLS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_FOLDER, 'stubs'))
+sys.path.insert(0, os.path.join(TOOLS_FOLDER, '..', 'Unistat.indigoPlugin', 'Contents', 'Server Plugin'))
+
+import indigo
+import plugin
+
+PLUGIN_ID = 'com.morris.unistat'
+
+################################################################################
+# Site
+################################################################################
+class Site(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, unistatCount, deviceCount, variableShare, seed, minInterval=0.0):
+        self.random = random.Random(seed)
+        self.nextId = 100000
+        self.sensors = list()
+        self.variables = list()
+        self.inputOf = dict()         # equipment/action group id -> input id
+        self.lastInputChange = dict() # input id -> time of last change
+        self.latencies = list()
+
+        # one input and one or two equipment targets per unistat, rest are bystanders
+        variableCount = int(unistatCount*variableShare)
+        sensorCount = max(unistatCount - variableCount, 1)
+        for index in range(sensorCount):
+            self.sensors.append(indigo.devices.add(indigo.SensorDevice(self.newId(), f'Sensor {index}',
+                {'temperature':20.0, 'batteryLevel':100, 'sensorValue':20.0})))
+        for index in range(variableCount):
+            self.variables.append(indigo.variables.add(indigo.Variable(self.newId(), f'Variable {index}', '20.0')))
+
+        self.unistats = list()
+        self.unistatInputs = list()   # (unistat, input device or variable)
+        for index in range(unistatCount):
+            if index < variableCount:
+                source = self.variables[index]
+                props = {'inputType':'var', 'inputVariable':str(source.id)}
+            else:
+                source = self.sensors[index - variableCount]
+                props = {'inputType':'dev', 'inputDevice':str(source.id), 'inputState':'temperature'}
+            inputId = source.id
+            props.update({
+                'deadband':'1.0', 'inputDecimals':'1', 'inputUnits':'', 'inputMinInterval':str(minInterval),
+                'SupportsCoolSetpoint':True, 'SupportsHeatSetpoint':True,
+                })
+
+            if index % 4 == 3:
+                deviceTypeId = 'ActionGroupUnistat'
+                groups = [indigo.actionGroups.add(indigo.ActionGroup(self.newId(), f'Group {index}.{n}')) for n in range(4)]
+                props.update({
+                    'coolerOnActionGroup':str(groups[0].id), 'coolerOffActionGroup':str(groups[1].id),
+                    'heaterOnActionGroup':str(groups[2].id), 'heaterOffActionGroup':str(groups[3].id),
+                    })
+                for group in groups:
+                    self.inputOf[group.id] = inputId
+            else:
+                deviceTypeId = 'DeviceUnistat'
+                equipmentClass = [indigo.RelayDevice, indigo.DimmerDevice, indigo.SpeedControlDevice][index % 3]
+                cooler = indigo.devices.add(equipmentClass(self.newId(), f'Cooler {index}'))
+                heater = indigo.devices.add(indigo.RelayDevice(self.newId(), f'Heater {index}'))
+                props.update({
+                    'coolDevices':[str(cooler.id)], 'heatDevices':[str(heater.id)],
+                    'dimmerControlLevel':'100', 'speedControlIndex':'3', 'deviceControlMode':'normal',
+                    })
+                self.inputOf[cooler.id] = inputId
+                self.inputOf[heater.id] = inputId
+
+            self.unistats.append(indigo.devices.add(indigo.ThermostatDevice(self.newId(), f'Unistat {index}',
+                {'setpointCool':23.0, 'setpointHeat':17.0, 'hvacOperationMode':indigo.kHvacMode.HeatCool,
+                 'temperatureInput1':20.0}, PLUGIN_ID, deviceTypeId, props)))
+            self.unistatInputs.append((self.unistats[-1], source))
+
+        self.bystanders = list()
+        while len(indigo.devices) < deviceCount + unistatCount:
+            self.bystanders.append(indigo.devices.add(indigo.SensorDevice(self.newId(), f'Other {len(self.bystanders)}',
+                {'sensorValue':0.0, 'batteryLevel':100})))
+
+    #-------------------------------------------------------------------------------
+    def newId(self):
+        self.nextId += 1
+        return self.nextId
+
+    #-------------------------------------------------------------------------------
+    def commandSent(self, targetId, when):
+        inputId = self.inputOf.get(targetId)
+        if inputId in self.lastInputChange:
+            self.latencies.append(when - self.lastInputChange[inputId])
+
+    #-------------------------------------------------------------------------------
+    def staleInputs(self):
+        # unistats whose input state does not match the current source value
+        stale = 0
+        for unistat, source in self.unistatInputs:
+            value = float(source.value) if isinstance(source, indigo.Variable) else source.states['temperature']
+            stale += unistat.states['temperatureInput1'] != value
+        return stale
+
+    #-------------------------------------------------------------------------------
+    def nextEvent(self):
+        # one synthetic change, applied to the stand-in host
+        roll = self.random.random()
+        if roll < 0.15 and self.bystanders:
+            device = self.random.choice(self.bystanders)
+            device._update({'sensorValue':round(self.random.uniform(0, 100), 1)})
+            return False
+        if roll < 0.30 and self.sensors:
+            device = self.random.choice(self.sensors)
+            device._update({'batteryLevel':self.random.randint(0, 100)})
+            return False
+
+        useVariable = self.variables and (not self.sensors or self.random.random() < len(self.variables)/float(len(self.variables) + len(self.sensors)))
+        if useVariable:
+            variable = self.random.choice(self.variables)
+            value = walk(self.random, float(variable.value))
+            self.lastInputChange[variable.id] = time.time()
+            indigo.variable.updateValue(variable, str(value))
+        else:
+            device = self.random.choice(self.sensors)
+            value = walk(self.random, device.states['temperature'])
+            self.lastInputChange[device.id] = time.time()
+            device._update({'temperature':value, 'sensorValue':value})
+        return True
+
+################################################################################
+# Utilities
+################################################################################
+def walk(rng, value):
+    # random walk that drifts back toward the middle of the 17..23 band
+    return round(value + rng.gauss((20.0 - value)*0.05, 0.6), 2)
+
+#-------------------------------------------------------------------------------
+def percentile(ordered, fraction):
+    if not ordered:
+        return float('nan')
+    return ordered[min(int(fraction*len(ordered)), len(ordered) - 1)]
+
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Unistat plugin against a stand-in indigo host.')
+    parser.add_argument('--unistats', type=int, default=500)
+    parser.add_argument('--devices', type=int, default=2000, help='non-unistat devices, including sensors and equipment')
+    parser.add_argument('--variables', type=float, default=0.2, help='share of unistats using a variable input')
+    parser.add_argument('--events', type=int, default=20000, help='synthetic input events to send')
+    parser.add_argument('--rate', type=float, default=0, help='target events per second (0 for as fast as possible)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-interval', type=float, default=0, dest='minInterval', help='unistat minimum input interval in seconds')
+    parser.add_argument('--batch', type=float, default=0, help='batch evaluation interval in seconds (0 to evaluate each unistat on its own)')
+    parser.add_argument('--verbose', action='store_true', help='show plugin log output')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(name)s %(message)s')
+
+    host = indigo.host
+    site = Site(args.unistats, args.devices, args.variables, args.seed, args.minInterval)
+
+    prefs = {'batchEvaluation':True, 'batchInterval':args.batch} if args.batch else {}
+    unistatPlugin = plugin.Plugin(PLUGIN_ID, 'Unistat', 'benchmark', prefs)
+    unistatPlugin.startup()
+    startTime = time.time()
+    for dev in site.unistats:
+        unistatPlugin.deviceStartComm(dev)
+    worker = threading.Thread(target=unistatPlugin.runConcurrentThread, name='runConcurrentThread')
+    worker.start()
+    while not unistatPlugin.started:
+        time.sleep(0.001)
+    host.deliver()
+    startupTime = time.time() - startTime
+
+    host.reset()
+    host.onCommand = site.commandSent
+    inputEvents = 0
+    interval = 1.0/args.rate if args.rate else 0.0
+    startTime = time.time()
+    for count in range(args.events):
+        if interval:
+            delay = startTime + count*interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        inputEvents += site.nextEvent()
+        host.deliver()
+    dispatchTime = time.time() - startTime
+
+    # let the worker apply held inputs, finish the last batch and send, delivering the resulting callbacks
+    settled = time.time() + args.minInterval
+    deadline = settled + 5.0 + args.batch
+    batch = unistatPlugin.batch
+    while (time.time() < settled or unistatPlugin.commandQueue.pending or (batch and batch.timer)) and time.time() < deadline:
+        time.sleep(0.01)
+        host.deliver()
+    unistatPlugin.stopConcurrentThread()
+    worker.join(5.0)
+    host.deliver()
+    staleInputs = site.staleInputs()
+    for dev in site.unistats:
+        unistatPlugin.deviceStopComm(dev)
+    unistatPlugin.shutdown()
+
+    latencies = sorted(site.latencies)
+    print(f'unistats {args.unistats}, devices {len(indigo.devices)}, variables {len(indigo.variables)}')
+    print(f'startup           {startupTime*1000:.1f} ms ({host.propsWrites} props writes)')
+    print(f'events            {args.events} ({inputEvents} input changes)')
+    print(f'throughput        {args.events/dispatchTime:,.0f} events/s ({dispatchTime:.2f} s)')
+    print(f'callbacks         {host.callbacks} delivered to the plugin')
+    print(f'state writes      {host.stateWriteCalls} calls, {host.stateKeysWritten} keys, {host.stateWriteCalls/max(inputEvents, 1):.3f} calls per input change')
+    print(f'commands          {host.commands}')
+    print(f'stale inputs      {staleInputs} unistats not showing their latest input')
+    print(f'latency input->command  p50 {percentile(latencies, 0.50)*1000:.2f} ms, p99 {percentile(latencies, 0.99)*1000:.2f} ms, max {(latencies[-1] if latencies else float("nan"))*1000:.2f} ms ({len(latencies)} samples)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Offline replay of recorded inputs through the unistat hysteresis rule.
+#
+# Runs on any machine with NumPy; the decision logic is imported from the
+# plugin bundle and does not need the indigo module.
+#
+#   python tools/replay.py log.csv --mode heat --setpoint 19:22:0.5 --deadband 0.25:2:0.25
+#
+# Input is a CSV of "timestamp,value" rows (epoch seconds or ISO 8601 times,
+# header optional) or a .npy/.npz array with timestamps in column 0 and values
+# in column 1.  The whole deadband x setpoint grid is evaluated at once: for
+# each grid point the equipment state at every sample is the outcome of the
+# most recent sample that left the deadband, found with a running maximum over
+# sample indexes instead of stepping through the samples in Python.
+#
+# The replay is open loop, so the recorded inputs do not react to the replayed
+# equipment.  Results per grid point:
+#   cycles        number of off->on transitions
+#   duty          fraction of time the equipment is on
+#   comfortError  time-weighted mean distance of the input beyond the deadband on
+#                 the side the equipment corrects: below it for heat, above it for cool
+
+import os
+import sys
+import csv
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Unistat.indigoPlugin', 'Contents', 'Server Plugin'))
+from hysteresis import coolerState, heaterState
+
+# grid points evaluated together, bounded so each chunk stays a few MB per sample column
+CHUNK_CELLS = 2**22
+
+################################################################################
+# Input
+################################################################################
+def loadSamples(path):
+    if path.endswith('.npy') or path.endswith('.npz'):
+        data = np.load(path)
+        if isinstance(data, np.lib.npyio.NpzFile):
+            data = data[data.files[0]]
+        data = np.asarray(data, dtype=float)
+        times, values = data[:,0], data[:,1]
+    else:
+        times, values = list(), list()
+        with open(path, newline='') as csvFile:
+            for row in csv.reader(csvFile):
+                if len(row) < 2:
+                    continue
+                try:
+                    values.append(float(row[1]))
+                except ValueError:
+                    continue  # header or junk
+                times.append(parseTime(row[0]))
+        times, values = np.array(times), np.array(values)
+
+    order = np.argsort(times, kind='stable')
+    return times[order], values[order]
+
+#-------------------------------------------------------------------------------
+def parseTime(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text.strip()).timestamp()
+
+#-------------------------------------------------------------------------------
+def parseRange(text):
+    # "start:stop:step" (inclusive) or a comma separated list
+    if ':' in text:
+        start, stop, step = (float(part) for part in text.split(':'))
+        return np.round(np.arange(start, stop + step/2.0, step), 9)
+    return np.array([float(part) for part in text.split(',')])
+
+################################################################################
+# Replay
+################################################################################
+def replayStates(values, setpoints, halfbands, mode='heat', initial=False):
+    # equipment state at every sample, shape (grid points, samples)
+    setpoints = np.asarray(setpoints, dtype=float)[:,None]
+    halfbands = np.asarray(halfbands, dtype=float)[:,None]
+    if mode == 'cool':
+        turnOn  = values > setpoints + halfbands
+        turnOff = values <= setpoints - halfbands
+    else:
+        turnOn  = values < setpoints - halfbands
+        turnOff = values >= setpoints + halfbands
+
+    # index of the latest decisive sample at or before each sample
+    indexes = np.where(turnOn | turnOff, np.arange(values.size), -1)
+    latest = np.maximum.accumulate(indexes, axis=1)
+    states = np.take_along_axis(turnOn, np.maximum(latest, 0), axis=1)
+    return np.where(latest >= 0, states, initial)
+
+#-------------------------------------------------------------------------------
+def replayGrid(times, values, setpoints, deadbands, mode='heat', initial=False):
+    setpointGrid, deadbandGrid = (grid.ravel() for grid in np.meshgrid(setpoints, deadbands, indexing='ij'))
+    halfbandGrid = deadbandGrid/2.0
+
+    # each sample holds until the next one; the last sample gets the median spacing
+    durations = np.diff(times, append=times[-1] + (np.median(np.diff(times)) if times.size > 1 else 1.0))
+    totalTime = durations.sum()
+
+    cycles = np.empty(setpointGrid.size, dtype=int)
+    duty = np.empty(setpointGrid.size)
+    comfortError = np.empty(setpointGrid.size)
+    chunk = max(1, CHUNK_CELLS//max(values.size, 1))
+    for start in range(0, setpointGrid.size, chunk):
+        rows = slice(start, start + chunk)
+        states = replayStates(values, setpointGrid[rows], halfbandGrid[rows], mode, initial)
+        previous = np.concatenate([np.full((states.shape[0], 1), initial), states[:,:-1]], axis=1)
+        cycles[rows] = np.count_nonzero(states & ~previous, axis=1)
+        duty[rows] = (states * durations).sum(axis=1)/totalTime
+        if mode == 'cool':
+            outside = values - (setpointGrid[rows,None] + halfbandGrid[rows,None])
+        else:
+            outside = (setpointGrid[rows,None] - halfbandGrid[rows,None]) - values
+        comfortError[rows] = (np.maximum(outside, 0.0) * durations).sum(axis=1)/totalTime
+
+    return {
+        'setpoint':     setpointGrid,
+        'deadband':     deadbandGrid,
+        'cycles':       cycles,
+        'duty':         duty,
+        'comfortError': comfortError,
+        }
+
+#-------------------------------------------------------------------------------
+def verifyPoint(values, setpoint, deadband, mode='heat', initial=False):
+    # step the plugin's own rule through the samples for one grid point
+    stateFunction = coolerState if mode == 'cool' else heaterState
+    isOn = initial
+    states = np.empty(values.size, dtype=bool)
+    for index, value in enumerate(values):
+        isOn = stateFunction(isOn, True, value, setpoint, deadband/2.0)
+        states[index] = isOn
+    return states
+
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay recorded inputs through the unistat hysteresis rule.')
+    parser.add_argument('samples', help='CSV (timestamp,value) or .npy/.npz file')
+    parser.add_argument('--mode', choices=['heat','cool'], default='heat', help='equipment side to replay')
+    parser.add_argument('--setpoint', required=True, help='start:stop:step or comma separated list')
+    parser.add_argument('--deadband', required=True, help='start:stop:step or comma separated list')
+    parser.add_argument('--initial', action='store_true', help='equipment is on before the first sample')
+    parser.add_argument('--verify', action='store_true', help='check the first grid point against the plugin rule')
+    parser.add_argument('--sort', choices=['cycles','duty','comfortError'], help='order the output by this column')
+    args = parser.parse_args(argv)
+
+    times, values = loadSamples(args.samples)
+    if not values.size:
+        parser.error(f'no samples in {args.samples}')
+    setpoints, deadbands = parseRange(args.setpoint), parseRange(args.deadband)
+
+    results = replayGrid(times, values, setpoints, deadbands, args.mode, args.initial)
+
+    if args.verify:
+        expected = verifyPoint(values, setpoints[0], deadbands[0], args.mode, args.initial)
+        actual = replayStates(values, setpoints[:1], deadbands[:1]/2.0, args.mode, args.initial)[0]
+        if not np.array_equal(expected, actual):
+            sys.exit(f'verify failed at sample {np.argmax(expected != actual)}')
+
+    order = np.argsort(results[args.sort], kind='stable') if args.sort else np.arange(results['setpoint'].size)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['setpoint', 'deadband', 'cycles', 'duty', 'comfortError'])
+    for index in order:
+        writer.writerow([
+            f"{results['setpoint'][index]:g}",
+            f"{results['deadband'][index]:g}",
+            results['cycles'][index],
+            f"{results['duty'][index]:.4f}",
+            f"{results['comfortError'][index]:.4f}",
+            ])
+
+if __name__ == '__main__':
+    main()
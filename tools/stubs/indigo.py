@@ -0,0 +1,395 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# In-process stand-in for the parts of the Indigo host API used by the
+# Unistat plugin, so plugin.py can be imported and driven on plain Python.
+#
+# Put this folder first on sys.path before importing plugin.py.  The host
+# object records state writes and equipment commands and queues the
+# deviceUpdated/variableUpdated callbacks Indigo would send; call
+# host.deliver() from the thread standing in for the host callback thread.
+
+import time
+import logging
+import threading
+from collections import deque
+
+################################################################################
+# Constants
+################################################################################
+class kHvacMode(object):
+    Off             = 0
+    Heat            = 1
+    Cool            = 2
+    HeatCool        = 3
+    ProgramHeat     = 4
+    ProgramCool     = 5
+    ProgramHeatCool = 6
+
+class kThermostatAction(object):
+    SetHvacMode          = 'SetHvacMode'
+    SetFanMode           = 'SetFanMode'
+    SetCoolSetpoint      = 'SetCoolSetpoint'
+    SetHeatSetpoint      = 'SetHeatSetpoint'
+    DecreaseCoolSetpoint = 'DecreaseCoolSetpoint'
+    IncreaseCoolSetpoint = 'IncreaseCoolSetpoint'
+    DecreaseHeatSetpoint = 'DecreaseHeatSetpoint'
+    IncreaseHeatSetpoint = 'IncreaseHeatSetpoint'
+    RequestStatusAll     = 'RequestStatusAll'
+    RequestMode          = 'RequestMode'
+    RequestEquipmentState= 'RequestEquipmentState'
+    RequestTemperatures  = 'RequestTemperatures'
+    RequestHumidities    = 'RequestHumidities'
+    RequestDeadbands     = 'RequestDeadbands'
+    RequestSetpoints     = 'RequestSetpoints'
+
+class kUniversalAction(object):
+    Beep          = 'Beep'
+    EnergyUpdate  = 'EnergyUpdate'
+    EnergyReset   = 'EnergyReset'
+    RequestStatus = 'RequestStatus'
+
+class kStateImageSel(object):
+    Auto = 'Auto'
+
+HVAC_MODE_STATES = (
+    ('hvacOperationModeIsOff',      kHvacMode.Off),
+    ('hvacOperationModeIsHeat',     kHvacMode.Heat),
+    ('hvacOperationModeIsCool',     kHvacMode.Cool),
+    ('hvacOperationModeIsAuto',     kHvacMode.HeatCool),
+    )
+
+Dict = dict
+List = list
+
+################################################################################
+# Host
+################################################################################
+class Host(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.plugin = None
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.onCommand = None
+        self.reset()
+
+    #-------------------------------------------------------------------------------
+    def reset(self):
+        self.stateWriteCalls = 0
+        self.stateKeysWritten = 0
+        self.propsWrites = 0
+        self.commands = 0
+        self.callbacks = 0
+
+    #-------------------------------------------------------------------------------
+    def deviceChanged(self, oldDev, newDev):
+        self.pending.append(('dev', oldDev, newDev))
+
+    #-------------------------------------------------------------------------------
+    def variableChanged(self, oldVar, newVar):
+        self.pending.append(('var', oldVar, newVar))
+
+    #-------------------------------------------------------------------------------
+    def deliver(self):
+        # send queued change callbacks to the plugin, as the host would
+        delivered = 0
+        while self.pending:
+            kind, old, new = self.pending.popleft()
+            if kind == 'dev':
+                self.plugin.deviceUpdated(old, new)
+            else:
+                self.plugin.variableUpdated(old, new)
+            delivered += 1
+        self.callbacks += delivered
+        return delivered
+
+    #-------------------------------------------------------------------------------
+    def command(self, device, changes):
+        device = devices[device if isinstance(device, int) else device.id]
+        self.commands += 1
+        if self.onCommand:
+            self.onCommand(device.id, time.time())
+        device._update(changes)
+
+host = Host()
+
+################################################################################
+# Objects
+################################################################################
+class Device(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, id, name, states=None, pluginId='', deviceTypeId='', pluginProps=None):
+        self.id = id
+        self.name = name
+        self.states = dict(states or {})
+        self.pluginId = pluginId
+        self.deviceTypeId = deviceTypeId
+        self.configured = True
+        self.enabled = True
+        self.errorState = ''
+        self._pluginProps = dict(pluginProps or {})
+
+    #-------------------------------------------------------------------------------
+    @property
+    def pluginProps(self):
+        return dict(self._pluginProps)
+
+    #-------------------------------------------------------------------------------
+    @property
+    def onState(self):
+        return self.states.get('onState', False)
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        oldDev = self.__class__.__new__(self.__class__)
+        oldDev.__dict__.update(self.__dict__)
+        oldDev.states = dict(self.states)
+        return oldDev
+
+    #-------------------------------------------------------------------------------
+    def _update(self, changes):
+        changed = {key:value for key, value in changes.items() if self.states.get(key) != value}
+        if changed:
+            oldDev = self.snapshot()
+            self.states.update(changed)
+            host.deviceChanged(oldDev, self)
+
+    #-------------------------------------------------------------------------------
+    def updateStateOnServer(self, key, value, uiValue=None, decimalPlaces=None, clearErrorState=True):
+        self.updateStatesOnServer([{'key':key, 'value':value}])
+
+    #-------------------------------------------------------------------------------
+    def updateStatesOnServer(self, keyValueList, clearErrorState=True):
+        host.stateWriteCalls += 1
+        host.stateKeysWritten += len(keyValueList)
+        if clearErrorState:
+            self.errorState = ''
+        self._update({item['key']:item['value'] for item in keyValueList})
+
+    #-------------------------------------------------------------------------------
+    def replacePluginPropsOnServer(self, props):
+        host.propsWrites += 1
+        self._pluginProps = dict(props)
+
+    #-------------------------------------------------------------------------------
+    def setErrorStateOnServer(self, errorState):
+        self.errorState = errorState or ''
+
+    #-------------------------------------------------------------------------------
+    def stateListOrDisplayStateIdChanged(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def refreshFromServer(self):
+        pass
+
+################################################################################
+class RelayDevice(Device):
+    pass
+
+################################################################################
+class DimmerDevice(Device):
+
+    #-------------------------------------------------------------------------------
+    @property
+    def brightness(self):
+        return self.states.get('brightnessLevel', 0)
+
+################################################################################
+class SpeedControlDevice(Device):
+
+    #-------------------------------------------------------------------------------
+    @property
+    def speedIndex(self):
+        return self.states.get('speedIndex', 0)
+
+################################################################################
+class SensorDevice(Device):
+
+    #-------------------------------------------------------------------------------
+    @property
+    def sensorValue(self):
+        return self.states.get('sensorValue')
+
+################################################################################
+class ThermostatDevice(Device):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super(ThermostatDevice, self).__init__(*args, **kwargs)
+        for key, value in (
+                ('temperatureInput1', 0.0),
+                ('setpointCool', 0.0),
+                ('setpointHeat', 0.0),
+                ('hvacOperationMode', kHvacMode.Off),
+                ('hvacCoolerIsOn', False),
+                ('hvacHeaterIsOn', False),
+                ):
+            self.states.setdefault(key, value)
+        self._updateModeStates(self.states)
+
+    #-------------------------------------------------------------------------------
+    def _update(self, changes):
+        if 'hvacOperationMode' in changes:
+            changes = dict(changes)
+            self._updateModeStates(changes)
+        super(ThermostatDevice, self)._update(changes)
+
+    #-------------------------------------------------------------------------------
+    def _updateModeStates(self, changes):
+        mode = changes.get('hvacOperationMode', self.states.get('hvacOperationMode'))
+        for key, value in HVAC_MODE_STATES:
+            changes[key] = (mode == value)
+
+################################################################################
+class Variable(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, id, name, value=''):
+        self.id = id
+        self.name = name
+        self.value = value
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        return Variable(self.id, self.name, self.value)
+
+################################################################################
+class ActionGroup(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.executions = 0
+
+################################################################################
+class Collection(dict):
+
+    #-------------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if isinstance(key, str) and not key.isdigit():
+            for item in self.values():
+                if item.name == key:
+                    return item
+            raise KeyError(key)
+        return dict.__getitem__(self, int(key))
+
+    #-------------------------------------------------------------------------------
+    def add(self, item):
+        self[item.id] = item
+        return item
+
+    #-------------------------------------------------------------------------------
+    def iter(self, filter=None):
+        return iter(list(self.values()))
+
+    #-------------------------------------------------------------------------------
+    def subscribeToChanges(self):
+        pass
+
+devices = Collection()
+variables = Collection()
+actionGroups = Collection()
+
+################################################################################
+# Command namespaces
+################################################################################
+class device(object):
+    @staticmethod
+    def turnOn(dev, **kwargs):
+        host.command(dev, {'onState':True})
+    @staticmethod
+    def turnOff(dev, **kwargs):
+        host.command(dev, {'onState':False})
+    @staticmethod
+    def toggle(dev, **kwargs):
+        dev = devices[dev if isinstance(dev, int) else dev.id]
+        host.command(dev, {'onState':not dev.onState})
+    @staticmethod
+    def statusRequest(dev, **kwargs):
+        pass
+
+class relay(device):
+    pass
+
+class dimmer(device):
+    @staticmethod
+    def setBrightness(dev, value, **kwargs):
+        host.command(dev, {'brightnessLevel':value, 'onState':bool(value)})
+
+class speedcontrol(device):
+    @staticmethod
+    def setSpeedIndex(dev, value, **kwargs):
+        host.command(dev, {'speedIndex':value, 'onState':bool(value)})
+
+class actionGroup(object):
+    @staticmethod
+    def execute(actionId, **kwargs):
+        group = actionGroups[actionId]
+        group.executions += 1
+        host.commands += 1
+        if host.onCommand:
+            host.onCommand(group.id, time.time())
+
+class variable(object):
+    @staticmethod
+    def updateValue(var, value):
+        var = variables[var if isinstance(var, int) else var.id]
+        if var.value != value:
+            oldVar = var.snapshot()
+            var.value = value
+            host.variableChanged(oldVar, var)
+
+class server(object):
+    installFolder = '/tmp/indigo'
+    @staticmethod
+    def getInstallFolderPath():
+        return server.installFolder
+    @staticmethod
+    def log(message, type=None, isError=False):
+        logging.getLogger('indigo').info(message)
+
+################################################################################
+# Plugin base class
+################################################################################
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger('Plugin')
+        self.stopThread = False
+        host.plugin = self
+
+    #-------------------------------------------------------------------------------
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def deviceCreated(self, dev):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def deviceDeleted(self, dev):
+        if dev.pluginId == self.pluginId:
+            self.deviceStopComm(dev)
+
+    #-------------------------------------------------------------------------------
+    def stopConcurrentThread(self):
+        self.stopThread = True
+
+    #-------------------------------------------------------------------------------
+    def sleep(self, seconds):
+        if self.stopThread:
+            raise self.StopThread
+        time.sleep(seconds)